@@ -10,6 +10,7 @@ from alembic import context
 from api.models import Base
 from api.models.user import *
 from api.models.tasks import *
+from api.models.ledger import *
 
 from config import ENV
 
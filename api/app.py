@@ -24,6 +24,9 @@ class FastAPIManager:
             ),
         )
         self.add_routers()
+        # in-process вызовы бота (BackendAPI, transport=asgi) идут в это же приложение:
+        # его startup, state и middleware, а не во второй экземпляр FastAPI
+        SystemRoutes.SRM.api_manager = self
 
     def add_routers(self):
         self.api.include_router(
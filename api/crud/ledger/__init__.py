@@ -0,0 +1,209 @@
+from datetime import datetime, timedelta
+import uuid
+from typing import Optional
+from sqlalchemy import exists, func, literal, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from .interface import LedgerInterface
+from .schema import LedgerRead
+from api.crud.task.schema import TaskCreate
+from api.crud.user import BusinessRuleError, UserNotFound
+from api.models.ledger import CoinLedger
+from api.models.tasks import Task
+from api.models.user import User
+
+UNIQUE = "uq_coin_ledger_reservation_kind"
+
+
+def _now() -> str:
+    return datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class LedgerCRUD(LedgerInterface):
+    """
+    Списания за генерации через журнал coin_ledger.
+
+    Каждый метод — одна транзакция: запись журнала и изменение users.coins
+    коммитятся вместе. Уникальность (reservation_id, kind) делает consume и refund
+    однократными: повторный вызов (колбэк, поллер, сверка) ничего не меняет.
+    """
+
+    def __init__(self):
+        pass
+
+    async def _take_coin(self, chat_id: str, session: AsyncSession) -> None:
+        # защита от ухода в минус на уровне SQL
+        stmt = (
+            update(User)
+            .where(User.chat_id == chat_id, User.coins > 0)
+            .values(coins=User.coins - 1)
+            .returning(User.coins)
+        )
+        if (await session.execute(stmt)).scalar_one_or_none() is None:
+            found = await session.scalar(select(func.count()).select_from(User).where(User.chat_id == chat_id))
+            await session.rollback()
+            if not found:
+                raise UserNotFound("User not found")
+            raise BusinessRuleError("Coins cannot go below zero")
+
+    @staticmethod
+    def _entry(reservation_id: uuid.UUID, chat_id: str, kind: str, delta: int, task_id: Optional[str] = None):
+        return insert(CoinLedger).values(
+            id=uuid.uuid4(),
+            reservation_id=reservation_id,
+            chat_id=chat_id,
+            kind=kind,
+            delta=delta,
+            task_id=task_id,
+            created_at=_now(),
+        )
+
+    @staticmethod
+    def _task(dto: TaskCreate):
+        if dto.created_at is None:
+            dto.created_at = _now()
+        return insert(Task).values(dto.model_dump()).on_conflict_do_nothing(index_elements=[Task.task_id])
+
+    async def reserve(self, chat_id: str, session: AsyncSession) -> str:
+        """Списывает монету под резерв; возвращает reservation_id."""
+        reservation_id = uuid.uuid4()
+        await self._take_coin(chat_id, session)
+        await session.execute(self._entry(reservation_id, chat_id, "reserve", -1))
+        await session.commit()
+        return str(reservation_id)
+
+    @staticmethod
+    async def _lock(reservation_id: uuid.UUID, session: AsyncSession):
+        """Блокирует строку reserve: consume и refund одного резерва идут по очереди."""
+        query = (
+            select(CoinLedger.reservation_id, CoinLedger.chat_id)
+            .where(CoinLedger.reservation_id == reservation_id, CoinLedger.kind == "reserve")
+            .with_for_update()
+        )
+        return (await session.execute(query)).first()
+
+    @staticmethod
+    def _settled(reservation_id, kind: str):
+        settled = aliased(CoinLedger)
+        return exists().where(settled.reservation_id == reservation_id, settled.kind == kind)
+
+    async def consume(
+        self, reservation_id: str, chat_id: str, task_id: str, session: AsyncSession, task: Optional[TaskCreate] = None,
+    ) -> None:
+        """
+        KIE принял задачу: резерв привязывается к task_id, запись задачи создаётся в той же транзакции.
+        Если резерв уже вернула сверка (KIE ответил позже grace), монета списывается заново —
+        даже в минус: задача в KIE уже идёт, долг закроет следующее пополнение.
+        """
+        rid = uuid.UUID(reservation_id)
+        await self._lock(rid, session)
+        entry = select(
+            literal(uuid.uuid4(), CoinLedger.id.type),
+            literal(rid, CoinLedger.reservation_id.type),
+            literal(chat_id),
+            literal("consume"),
+            literal(0),
+            literal(task_id),
+            literal(_now()),
+        ).where(~self._settled(rid, "refund"))
+        stmt = (
+            insert(CoinLedger)
+            .from_select(["id", "reservation_id", "chat_id", "kind", "delta", "task_id", "created_at"], entry)
+            .on_conflict_do_nothing(constraint=UNIQUE)
+            .returning(CoinLedger.id)
+        )
+        if (await session.execute(stmt)).scalar_one_or_none() is None:
+            refunded = await session.scalar(select(self._settled(rid, "refund")))
+            consumed = await session.scalar(select(self._settled(rid, "consume")))
+            if refunded and not consumed:
+                again = uuid.uuid4()
+                await session.execute(update(User).where(User.chat_id == chat_id).values(coins=User.coins - 1))
+                await session.execute(self._entry(again, chat_id, "reserve", -1, task_id))
+                await session.execute(self._entry(again, chat_id, "consume", 0, task_id))
+        if task is not None:
+            await session.execute(self._task(task))
+        await session.commit()
+
+    async def charge(self, chat_id: str, task_id: str, session: AsyncSession, task: Optional[TaskCreate] = None) -> str:
+        """Списание без ожидания KIE (готовое видео из кэша): reserve + consume + задача одной транзакцией."""
+        reservation_id = uuid.uuid4()
+        await self._take_coin(chat_id, session)
+        await session.execute(self._entry(reservation_id, chat_id, "reserve", -1, task_id))
+        await session.execute(self._entry(reservation_id, chat_id, "consume", 0, task_id))
+        if task is not None:
+            await session.execute(self._task(task))
+        await session.commit()
+        return str(reservation_id)
+
+    async def refund(
+        self,
+        session: AsyncSession,
+        reservation_id: Optional[str] = None,
+        task_id: Optional[str] = None,
+        unconsumed: bool = False,
+    ) -> Optional[bool]:
+        """
+        Возврат монеты по резерву или по задаче.
+        unconsumed — только если резерв не привязан к задаче (сверка резервов).
+        True — вернули сейчас, False — уже было возвращено (или consumed), None — резерва нет (задача до журнала).
+        """
+        if reservation_id is None:
+            query = select(CoinLedger.reservation_id).where(
+                CoinLedger.task_id == task_id, CoinLedger.kind.in_(("reserve", "consume"))
+            )
+            reservation_id = await session.scalar(query.limit(1))
+            if reservation_id is None:
+                await session.rollback()
+                return None
+        rid = reservation_id if isinstance(reservation_id, uuid.UUID) else uuid.UUID(reservation_id)
+        row = await self._lock(rid, session)
+        if row is None:
+            await session.rollback()
+            return None
+        if unconsumed and await session.scalar(select(self._settled(rid, "consume"))):
+            await session.rollback()
+            return False
+
+        inserted = await session.execute(
+            self._entry(row.reservation_id, row.chat_id, "refund", 1, task_id)
+            .on_conflict_do_nothing(constraint=UNIQUE)
+            .returning(CoinLedger.id)
+        )
+        if inserted.scalar_one_or_none() is None:
+            await session.rollback()
+            return False
+        await session.execute(update(User).where(User.chat_id == row.chat_id).values(coins=User.coins + 1))
+        await session.commit()
+        return True
+
+    async def refund_stale(self, session: AsyncSession, older_than: int, limit: int = 100) -> int:
+        """Возвращает резервы, которые за older_than секунд не привязались к задаче и не вернулись (процесс упал)."""
+        cutoff = (datetime.utcnow() - timedelta(seconds=older_than)).strftime("%Y-%m-%d %H:%M:%S")
+        settled = aliased(CoinLedger)
+        query = (
+            select(CoinLedger.reservation_id)
+            .where(
+                CoinLedger.kind == "reserve",
+                CoinLedger.created_at < cutoff,
+                ~exists().where(settled.reservation_id == CoinLedger.reservation_id, settled.kind != "reserve"),
+            )
+            .limit(limit)
+        )
+        stale = (await session.execute(query)).scalars().all()
+        await session.rollback()
+        refunded = 0
+        for reservation_id in stale:
+            if await self.refund(session, reservation_id=str(reservation_id), unconsumed=True):
+                refunded += 1
+        return refunded
+
+    async def history(self, chat_id: str, session: AsyncSession, limit: int = 100) -> list[LedgerRead]:
+        query = (
+            select(CoinLedger)
+            .where(CoinLedger.chat_id == chat_id)
+            .order_by(CoinLedger.created_at.desc())
+            .limit(limit)
+        )
+        res = await session.execute(query)
+        return [LedgerRead.model_validate(entry) for entry in res.scalars().all()]
@@ -0,0 +1,27 @@
+from __future__ import annotations
+from abc import ABC, abstractmethod
+
+class LedgerInterface(ABC):
+    @abstractmethod
+    async def reserve():
+        pass
+
+    @abstractmethod
+    async def consume():
+        pass
+
+    @abstractmethod
+    async def charge():
+        pass
+
+    @abstractmethod
+    async def refund():
+        pass
+
+    @abstractmethod
+    async def refund_stale():
+        pass
+
+    @abstractmethod
+    async def history():
+        pass
@@ -0,0 +1,15 @@
+from pydantic import BaseModel
+from typing import Literal, Optional
+import uuid
+
+class LedgerRead(BaseModel):
+    id: uuid.UUID
+    reservation_id: uuid.UUID
+    chat_id: str
+    kind: Literal["reserve", "consume", "refund"]
+    delta: int
+    task_id: Optional[str] = None
+    created_at: str
+
+    class Config:
+        from_attributes = True
@@ -2,6 +2,7 @@ from datetime import datetime
 from .interface import TaskInterface
 from typing import Any, Dict, Optional
 from sqlalchemy import insert, select, update, delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from .schema import TaskCreate, TaskRead
 from api.models.tasks import Task
@@ -13,7 +14,8 @@ class TaskCRUD(TaskInterface):
     async def create_task(self, dto: TaskCreate, session: AsyncSession) -> Dict[str, Any]:
         if dto.created_at is None:
             dto.created_at = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-        query = insert(Task).values(dto.model_dump())
+        # запись могла уже создать генерация (вместе со списанием) — повтор не ошибка
+        query = pg_insert(Task).values(dto.model_dump()).on_conflict_do_nothing(index_elements=[Task.task_id])
         await session.execute(query)
         await session.commit()
         return {"ok": True}
@@ -47,4 +49,24 @@ class TaskCRUD(TaskInterface):
         query = select(Task.chat_id).where(task_id == Task.task_id)
         res = await session.execute(query)
         data = res.scalar_one_or_none()
-        return data
\ No newline at end of file
+        return data
+
+    async def set_completed(self, task_id: str, session: AsyncSession) -> None:
+        query = (
+            update(Task)
+            .where(Task.task_id == task_id, Task.completed_at.is_(None))
+            .values(completed_at=datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"))
+        )
+        await session.execute(query)
+        await session.commit()
+
+    async def recent_durations(self, session: AsyncSession, limit: int = 2000) -> list[tuple[Optional[str], str, str]]:
+        """(raw, created_at, completed_at) последних завершённых задач."""
+        query = (
+            select(Task.raw, Task.created_at, Task.completed_at)
+            .where(Task.completed_at.is_not(None))
+            .order_by(Task.completed_at.desc())
+            .limit(limit)
+        )
+        res = await session.execute(query)
+        return [tuple(row) for row in res.all()]
@@ -16,4 +16,12 @@ class TaskInterface(ABC):
 
     @abstractmethod
     async def set_rating():
-        pass
\ No newline at end of file
+        pass
+
+    @abstractmethod
+    async def set_completed():
+        pass
+
+    @abstractmethod
+    async def recent_durations():
+        pass
@@ -1,9 +1,10 @@
 from typing import Any, Dict, Literal
-from sqlalchemy import insert, select, update, delete, func
+from sqlalchemy import insert, select, update, delete, func, text
 from .interface import UserInterface
 from sqlalchemy.ext.asyncio import AsyncSession
 from .schema import CoinMinus, CoinPlus, UserDelete, UserRegister
 from api.models.user import User
+from utils.referral import RefLink
 
 
 class UserNotFound(Exception): ...
@@ -21,6 +22,30 @@ class UserService(UserInterface):
         await session.commit()
         return {"ok": True}
 
+    async def bootstrap_user(self, dto: UserRegister, session: AsyncSession) -> Dict[str, Any]:
+        """
+        Гарантирует, что пользователь есть, и сразу отдаёт данные для экрана /start.
+        Обычный путь (пользователь уже есть) — один SELECT. Новый пользователь создаётся
+        под advisory-локом по chat_id, чтобы параллельные /start не завели дубль.
+        """
+        query = select(User.coins, User.role, User.ref_code).where(User.chat_id == dto.chat_id).limit(1)
+        row = (await session.execute(query)).first()
+        if row:
+            return {"created": False, "coins": row.coins, "role": row.role, "ref_code": row.ref_code}
+
+        await session.execute(text("SELECT pg_advisory_xact_lock(hashtext(:chat_id))"), {"chat_id": dto.chat_id})
+        row = (await session.execute(query)).first()
+        if row:
+            await session.commit()
+            return {"created": False, "coins": row.coins, "role": row.role, "ref_code": row.ref_code}
+
+        if dto.ref_code is None:
+            dto.ref_code = await self._new_ref_code(dto.role, session)
+        stmt = insert(User).values(dto.model_dump()).returning(User.coins, User.role, User.ref_code)
+        row = (await session.execute(stmt)).one()
+        await session.commit()
+        return {"created": True, "coins": row.coins, "role": row.role, "ref_code": row.ref_code}
+
     async def get_user(self, chat_id: str, session: AsyncSession):
         res = await session.execute(select(User).where(User.chat_id == chat_id))
         user = res.scalar_one_or_none()
@@ -98,6 +123,15 @@ class UserService(UserInterface):
         if res.rowcount == 0:
             raise UserNotFound("User not found")
         
+    async def _new_ref_code(self, role: Literal["user", "partner"], session: AsyncSession) -> str:
+        # проверяем только сгенерированный код, а не выгружаем все существующие
+        ref_link = RefLink()
+        while True:
+            code = ref_link.generate_ref_code(codes=[], role=role)
+            taken = await session.scalar(select(func.count()).select_from(User).where(User.ref_code == code))
+            if not taken:
+                return code
+
     async def get_ref_code(self, chat_id: str, session: AsyncSession) -> str | None:
         res = await session.execute(select(User.ref_code).where(User.chat_id == chat_id))
         code = res.scalar_one_or_none()
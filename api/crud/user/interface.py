@@ -6,6 +6,10 @@ class UserInterface(ABC):
     async def register_user():
         pass
 
+    @abstractmethod
+    async def bootstrap_user():
+        pass
+
     @abstractmethod
     async def get_user():
         pass
@@ -18,6 +18,13 @@ class UserRegister(BaseModel):
     class Config:
         from_attributes = True
 
+class UserBootstrap(BaseModel):
+    nickname: Optional[str] = None
+    role: Literal["user", "partner"] = "user"
+
+    class Config:
+        from_attributes = True
+
 class UserRead(UserSchema):
     ...
 
@@ -0,0 +1,24 @@
+from api.models import Base
+
+import uuid
+from sqlalchemy import UUID, Integer, String, UniqueConstraint
+
+from sqlalchemy.orm import mapped_column, Mapped
+
+class CoinLedger(Base):
+    """
+    Журнал списаний за генерации, только вставки.
+    Резерв монеты (reserve, -1) затем либо привязывается к задаче KIE (consume, 0),
+    либо возвращается (refund, +1); refund возможен и после consume — задача упала.
+    users.coins — агрегат, меняется в той же транзакции, что и запись журнала.
+    """
+    __tablename__ = "coin_ledger"
+    __table_args__ = (UniqueConstraint("reservation_id", "kind", name="uq_coin_ledger_reservation_kind"),)
+
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    reservation_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), nullable=False)
+    chat_id: Mapped[str] = mapped_column(String, nullable=False, index=True)
+    kind: Mapped[str] = mapped_column(String, nullable=False)
+    delta: Mapped[int] = mapped_column(Integer, nullable=False)
+    task_id: Mapped[str] = mapped_column(String, nullable=True, index=True)
+    created_at: Mapped[str] = mapped_column(String, nullable=False)
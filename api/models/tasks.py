@@ -16,3 +16,5 @@ class Task(Base):
     is_video: Mapped[bool] = mapped_column(Boolean, default=False)
     rating: Mapped[int] = mapped_column(Integer, default=0, nullable=True)
     created_at: Mapped[str] = mapped_column(String, default=datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"))
+    # момент колбэка KIE с готовым видео, тот же формат, что и created_at
+    completed_at: Mapped[str] = mapped_column(String, nullable=True)
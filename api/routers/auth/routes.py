@@ -5,7 +5,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from api.database import get_async_session
 from api.crud.user.schema import (
-    UserRegister, UserDelete, CoinMinus, CoinPlus
+    UserBootstrap, UserRegister, UserDelete, CoinMinus, CoinPlus
 )
 from api.crud.user import UserService, UserNotFound, BusinessRuleError
 from utils.referral import RefLink
@@ -53,6 +53,52 @@ async def register_user(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 
+@router.post("/{chat_id}/bootstrap", summary="Вход пользователя: регистрация при необходимости и данные для старта")
+async def bootstrap_user(
+    chat_id: str,
+    dto: UserBootstrap,
+    session: AsyncSession = Depends(get_async_session),
+    service: UserService = Depends(get_user_service),
+):
+    """
+    Один запрос вместо проверки существования, регистрации и получения баланса.
+    Если пользователя нет — он создаётся, если есть — просто возвращаются его данные.
+
+    Cтатус запроса:
+    - 200 OK - пользователь существует или создан
+    - 422 Unprocessable Entity - ошибка валидации входных данных
+
+    > [!important]
+    > Заголовки запроса:
+    > - `X-API-KEY: str` - API ключ для аутентификации (обязательный)
+
+    Входные данные:
+    - `chat_id: str` - уникальный идентификатор пользователя в Telegram
+    - `nickname: str | None` - имя пользователя в Telegram
+    - `role: str` - роль для нового пользователя (по умолчанию "user")
+
+    Выходные данные:
+    - `ok: bool` - статус успешности запроса
+    - `created: bool` - пользователь был создан этим запросом
+    - `coins: int` - количество монет у пользователя
+    - `role: str` - роль пользователя
+    - `ref_code: str | None` - реферальный код пользователя
+    - `ref_link: str | None` - реферальная ссылка на бота
+    """
+    register = UserRegister(
+        chat_id=chat_id,
+        nickname=(dto.nickname or f"user_{chat_id}")[:64],
+        role=dto.role,
+    )
+    data = await service.bootstrap_user(register, session)
+    ref_code = data["ref_code"]
+    return {
+        "ok": True,
+        **data,
+        "ref_link": f"https://t.me/{env.bot_username}?start={ref_code}" if ref_code else None,
+    }
+
+
 @router.get("/{chat_id}", summary="Получение информации о пользователе")
 async def get_user(
     chat_id: str,
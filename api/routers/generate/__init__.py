@@ -1,20 +1,31 @@
 from fastapi import APIRouter, Depends
 from api.crud.user import UserService
-from services.kie import GenerateRequests
+from services.kie import GenerateRequests, kie_client
 from services.notifier import BotNotifier
 from services.redis import RedisClient
-from services.storage import YandexS3Storage
+from services.storage import YandexS3Storage, get_storage
 from services.veo import VeoService
 from api.crud.task import TaskCRUD
+from services.admission import AdmissionController
+from config import ENV
 
 
 
+env = ENV()
+# один на процесс: очередь ожидания живёт в нём, слоты — в Redis
+admission = AdmissionController(
+    global_limit=env.kie_max_inflight,
+    user_limit=env.kie_max_inflight_per_user or env.kie_max_inflight,
+    max_wait=env.admission_max_wait,
+    horizon=env.reconcile_timeout,
+)
+
 def get_user_service() -> UserService: return UserService()
-def get_storage() -> YandexS3Storage: return YandexS3Storage()
-def get_kie_client() -> GenerateRequests: return GenerateRequests()
+def get_kie_client() -> GenerateRequests: return kie_client
 def get_redis() -> RedisClient: return RedisClient()
 def get_notifier() -> BotNotifier: return BotNotifier()
 def get_task_crud() -> TaskCRUD: return TaskCRUD()
+def get_admission() -> AdmissionController: return admission
 
 def get_veo_service(
     users: UserService = Depends(get_user_service),
@@ -22,5 +33,10 @@ def get_veo_service(
     storage: YandexS3Storage = Depends(get_storage),
     redis: RedisClient = Depends(get_redis),
     notifier: BotNotifier = Depends(get_notifier),
+    tasks: TaskCRUD = Depends(get_task_crud),
+    admission: AdmissionController = Depends(get_admission),
 ) -> VeoService:
-    return VeoService(users=users, gen=gen, storage=storage, redis=redis, notifier=notifier)
\ No newline at end of file
+    return VeoService(
+        users=users, gen=gen, storage=storage, redis=redis, notifier=notifier, tasks=tasks,
+        admission=admission, partner_weight=env.admission_partner_weight,
+    )
\ No newline at end of file
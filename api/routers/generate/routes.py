@@ -1,11 +1,11 @@
+import asyncio
 import logging
 from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status
 from api.crud.user import UserService
-from api.crud.user.schema import CoinPlus
-from api.database import get_async_session
-from api.routers.generate import get_redis, get_task_crud, get_veo_service, get_user_service
-from api.routers.generate.schema import CallbackOut, GenerateOut, GeneratePhotoIn, GenerateTextIn, KIECallbackIn, StatusOut, VideoReadyIn
+from api.database import async_session_maker, get_async_session
+from api.routers.generate import get_admission, get_redis, get_task_crud, get_veo_service, get_user_service, get_kie_client, get_notifier, get_storage
+from api.routers.generate.schema import CallbackOut, GenerateOut, GeneratePhotoIn, GenerateTextIn, KIECallbackIn, QueueOut, StatusOut, VideoFailedIn, VideoReadyIn
 from services.redis import RedisClient
 from services.veo import VeoCallbackAuthError, VeoService, VeoServiceError
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -14,9 +14,97 @@ from aiogram import types
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from api.crud.task import TaskCRUD
 from utils.progress import finish_progress
+from bot.api.cache import backend_cache
+from bot.outbound import Priority, outbound_priority
+from bot.media import media
+from services.admission import AdmissionController
+from services.poller import KieStatusPoller
+from services.reconciler import StaleTaskReconciler
+from services.bground.tasks import callback_job_id, postprocess_callback
+from utils.metrics import metrics
+from config import ENV
 
 
 router = APIRouter()
+env = ENV()
+
+
+def _make_service() -> VeoService:
+    return get_veo_service(get_user_service(), get_kie_client(), get_storage(), get_redis(), get_notifier(), get_task_crud(), get_admission())
+
+
+async def _on_poll_failed(task_id: str, reason: Optional[str]) -> None:
+    svc = _make_service()
+    async with async_session_maker() as session:
+        await svc.fail_task(task_id, session, reason=reason)
+
+
+poller = KieStatusPoller(
+    on_failed=_on_poll_failed,
+    gen=get_kie_client(),
+    interval=env.kie_poll_interval,
+    concurrency=env.kie_poll_concurrency,
+)
+
+reconciler = StaleTaskReconciler(
+    make_service=_make_service,
+    gen=get_kie_client(),
+    interval=env.reconcile_interval,
+    grace=env.reconcile_grace,
+    timeout=env.reconcile_timeout,
+    concurrency=env.kie_poll_concurrency,
+)
+
+
+@router.on_event("startup")
+async def start_status_poller():
+    try:
+        await get_storage().start()
+    except Exception as e:
+        logging.warning("S3 bucket check failed: %s", e)
+    if env.kie_poll_interval > 0:
+        await poller.start()
+    if env.reconcile_interval > 0:
+        await reconciler.start()
+
+
+@router.on_event("shutdown")
+async def stop_status_poller():
+    await poller.stop()
+    await reconciler.stop()
+    await get_kie_client().close()
+    get_storage().close()
+
+
+def _deliver_cached(background: BackgroundTasks, svc: VeoService, chat_id: str, data: dict) -> None:
+    """Видео из кэша уходит обычной доставкой (video-ready) уже после ответа боту."""
+    if data.get("cached"):
+        background.add_task(
+            svc.notifier.video_ready, chat_id=chat_id, task_id=data["task_id"], result_url=data["result_url"],
+        )
+
+
+class _QueueNotice:
+    """Сообщение о месте в очереди KIE, пока запрос пользователя ждёт слот."""
+
+    def __init__(self, chat_id: str):
+        self.chat_id = chat_id
+        self.message: Optional[types.Message] = None
+
+    async def __call__(self, position: int) -> None:
+        text = f"⏳ Сейчас много генераций — вы в очереди, место {position}. Начнём автоматически."
+        with outbound_priority(Priority.REPLY):
+            if self.message is None:
+                self.message = await bot_manager.bot.send_message(chat_id=self.chat_id, text=text)
+            else:
+                await bot_manager.bot.edit_message_text(text=text, chat_id=self.chat_id, message_id=self.message.message_id)
+
+    async def close(self) -> None:
+        if self.message is not None:
+            try:
+                await bot_manager.bot.delete_message(chat_id=self.chat_id, message_id=self.message.message_id)
+            except Exception:
+                pass
 
 
 @router.post(
@@ -26,6 +114,7 @@ router = APIRouter()
         )
 async def generate_text(
     payload: GenerateTextIn,
+    background: BackgroundTasks,
     session: AsyncSession = Depends(get_async_session),
     svc: VeoService = Depends(get_veo_service),
     task: TaskCRUD = Depends(get_task_crud)
@@ -46,23 +135,36 @@ async def generate_text(
     - `chat_id: str` - уникальный идентификатор пользователя в Telegram
     - `prompt: str` - текстовое описание для генерации видео
     - `aspect_ratio: str | None` - соотношение сторон видео ("16:9", "9:16")
+    - `fresh: bool` - не брать готовое видео из кэша («другой вариант»)
     """
+    notice = _QueueNotice(payload.chat_id)
     try:
         data = await svc.generate_by_text(
             chat_id=payload.chat_id,
             prompt=payload.prompt,
             aspect_ratio=payload.aspect_ratio,
-            session=session
+            session=session,
+            on_position=notice,
+            fresh=payload.fresh,
+        )
+        _deliver_cached(background, svc, payload.chat_id, data)
+        return GenerateOut(
+            ok=True,
+            task_id=data["task_id"],
+            raw=data.get("raw"),
+            cached=data.get("cached", False),
+            result_url=data.get("result_url"),
         )
-        return GenerateOut(ok=True, task_id=data["task_id"], raw=data.get("raw"))
     except VeoServiceError as e:
         logging.error("VeoServiceError: %s", e)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
-    except Exception:
+    except Exception as e:
         logging.exception("Error generating from text: %s", e)
         raise HTTPException(
             status_code=status.HTTP_502_BAD_GATEWAY, detail="KIE unavailable")
+    finally:
+        await notice.close()
 
 
 @router.post(
@@ -72,6 +174,7 @@ async def generate_text(
         )
 async def generate_photo(
     dto: GeneratePhotoIn,
+    background: BackgroundTasks,
     session: AsyncSession = Depends(get_async_session),
     svc: VeoService = Depends(get_veo_service),
     task: TaskCRUD = Depends(get_task_crud)
@@ -93,21 +196,28 @@ async def generate_photo(
     - `prompt: str` - текстовое описание для генерации видео
     - `image_url: str | None` - URL изображения для генерации видео
     - `aspect_ratio: str | None` - соотношение сторон видео ("16:9", "9:16")
+    - `fresh: bool` - не брать готовое видео из кэша («другой вариант»)
     """
 
+    notice = _QueueNotice(dto.chat_id)
     try:
         data = await svc.generate_by_photo(
             chat_id=dto.chat_id,
             prompt=dto.prompt,
             image_url=dto.image_url,
             aspect_ratio=dto.aspect_ratio,
-            session=session
+            session=session,
+            on_position=notice,
+            fresh=dto.fresh,
         )
+        _deliver_cached(background, svc, dto.chat_id, data)
         return GenerateOut(
             ok=True,
             task_id=data["task_id"],
             input_image_url=data.get("input_image_url"),
             raw=data.get("raw"),
+            cached=data.get("cached", False),
+            result_url=data.get("result_url"),
         )
     except VeoServiceError as e:
         logging.error("VeoServiceError: %s", e)
@@ -117,6 +227,30 @@ async def generate_photo(
         logging.exception("Error generating from photo: %s", e)
         raise HTTPException(
             status_code=status.HTTP_502_BAD_GATEWAY, detail="KIE unavailable")
+    finally:
+        await notice.close()
+
+
+@router.get(
+        "/generate/queue",
+        response_model=QueueOut,
+        summary="Очередь на генерацию"
+        )
+async def get_queue(
+    chat_id: Optional[str] = None,
+    admission: AdmissionController = Depends(get_admission),
+):
+    """
+    Длина очереди запросов, ждущих слот KIE в этом воркере, и место пользователя в ней.
+
+    > [!important]
+    > Заголовки запроса:
+    > - `X-API-KEY: str` - API ключ для аутентификации (обязательный)
+
+    Входные данные:
+    - `chat_id: str | None` - уникальный идентификатор пользователя в Telegram
+    """
+    return QueueOut(depth=admission.depth(), position=admission.position(chat_id) if chat_id else None)
 
 
 @router.get(
@@ -170,9 +304,7 @@ public_router = APIRouter()
 async def veo_complete(
     payload: KIECallbackIn,
     svc: VeoService = Depends(get_veo_service),
-    task: TaskCRUD = Depends(get_task_crud),
     session: AsyncSession = Depends(get_async_session),
-    user: UserService = Depends(get_user_service)
 ):
     """
     Колбэк от KIE (Veo 3) о завершении задачи генерации видео.
@@ -200,21 +332,23 @@ async def veo_complete(
     - `result_url: str | None` - URL сгенерированного видео (если задача завершена)
     - `fallback: bool | None` - флаг использования резервного метода генерации
     """
-    chat_id: Optional[str]
     try:
         print(payload)
-        if payload.code == 400:
-            chat_id = await task.get_chatID_by_taskID(payload.data.taskId, session)
-            if chat_id:
-                await user.plus_coins(CoinPlus(chat_id=chat_id, count=1), session)
-                await finish_progress(payload.data.taskId, bot_manager.bot)
-                await bot_manager.bot.send_message(
-                    chat_id=int(chat_id), 
-                    text=(
-                       "Видео не вернулось 😕\n"
-"Обычно такое случается, если описание или фото слишком жёсткое или содержит то, что система не может показать. Попробуйте переформулировать или заменить фото — и я сделаю ролик!"
-                    ))
-        res = await svc.handle_callback(payload.model_dump())
+        task_id = payload.data.taskId
+        # повторная доставка: один round trip в Redis, без загрузок, возвратов и сообщений
+        created, state, done = await svc.redis.callback_receive(task_id)
+        if state == "done":
+            metrics.inc("veo.callback.duplicate")
+            return CallbackOut(ok=True, **(done or {"task_id": task_id, "status": "done"}))
+        if state == "processing" or (env.callback_mode == "celery" and not created):
+            # обрабатывается сейчас или уже стоит в очереди Celery
+            metrics.inc("veo.callback.duplicate")
+            return CallbackOut(ok=True, task_id=task_id, status="processing")
+        if env.callback_mode == "celery":
+            # KIE получает ответ сразу после постановки в очередь, тяжёлая часть — в воркере
+            await _enqueue_callback(payload.model_dump(), svc.redis)
+            return CallbackOut(ok=True, task_id=task_id, status="queued")
+        res = await svc.process_callback(payload.model_dump(), session)
         return CallbackOut(ok=True, **res)
     except VeoCallbackAuthError:
         logging.error("Callback unauthorized")
@@ -226,6 +360,27 @@ async def veo_complete(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 
+async def _enqueue_callback(payload: dict, redis: RedisClient) -> None:
+    """
+    Ставит postprocess_callback в брокер Celery. Вызывается только для впервые
+    принятого taskId, так что повторная доставка в очередь не попадает.
+    """
+    task_id = payload["data"]["taskId"]
+    try:
+        # kombu синхронный — публикуем в потоке, чтобы не держать event loop
+        await asyncio.to_thread(
+            postprocess_callback.apply_async,
+            args=[payload],
+            task_id=callback_job_id(task_id),
+            retry=True,
+        )
+    except Exception:
+        # не поставили — пусть KIE доставит колбэк ещё раз
+        await redis.callback_forget(task_id)
+        raise
+    metrics.inc("veo.callback.enqueued")
+
+
 internal = APIRouter()
 
 
@@ -237,6 +392,42 @@ def rating_kb(task_id: str) -> types.InlineKeyboardMarkup:
     return kb.as_markup()
 
 
+@internal.post(
+        "/veo/video-failed",
+        summary="Уведомление о неудачной генерации"
+        )
+async def video_failed(payload: VideoFailedIn):
+    """
+    Уведомление о неудачной генерации (внутренний эндпоинт).
+    Вызывается после возврата монеты: убирает прогресс-бар, сбрасывает кэш баланса бота
+    и сообщает пользователю, что видео не получилось.
+
+    Cтатус запроса:
+    - 200 OK - успешная обработка уведомления
+    - 500 Internal Server Error - внутренняя ошибка сервера при обработке уведомления
+
+    Входные данные:
+    - `chat_id: str` - уникальный идентификатор пользователя в Telegram
+    - `task_id: str` - уникальный идентификатор задачи генерации
+    - `reason: str | None` - причина неудачи от KIE
+    """
+    try:
+        await backend_cache.invalidate(payload.chat_id)
+        with outbound_priority(Priority.DELIVERY):
+            await finish_progress(payload.task_id, bot_manager.bot)
+            await bot_manager.bot.send_message(
+                chat_id=int(payload.chat_id),
+                text=(
+                    "Видео не вернулось 😕\n"
+                    "Обычно такое случается, если описание или фото слишком жёсткое или содержит то, что система не может показать. Попробуйте переформулировать или заменить фото — и я сделаю ролик!"
+                ))
+        return {"ok": True}
+    except Exception as e:
+        logging.exception("Error sending video failed message: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
 @internal.post(
         "/veo/video-ready",
         summary="Уведомление о готовности видео"
@@ -263,17 +454,17 @@ async def video_ready(
     text = ("Видео готово!")
     try:
 
-        await finish_progress(payload.task_id, bot_manager.bot)
-        await bot_manager.bot.send_video(chat_id=payload.chat_id,
-                                         video=types.URLInputFile(
-                                             payload.result_url),
-                                         caption=text,
-                                         show_caption_above_media=True
-                                         )
-        rating_message = await bot_manager.bot.send_message(chat_id=payload.chat_id,
-                                           text="Пожалуйста, оцените качество видео от 1 до 5:",
-                                           reply_markup=rating_kb(payload.task_id),
-                                           )
+        with outbound_priority(Priority.DELIVERY):
+            await finish_progress(payload.task_id, bot_manager.bot)
+            await media.send(bot_manager.bot, "video", payload.chat_id, payload.result_url,
+                             upload=True,
+                             caption=text,
+                             show_caption_above_media=True,
+                             )
+            rating_message = await bot_manager.bot.send_message(chat_id=payload.chat_id,
+                                               text="Пожалуйста, оцените качество видео от 1 до 5:",
+                                               reply_markup=rating_kb(payload.task_id),
+                                               )
         await redis.set_del_msg(key=f"{payload.chat_id}:{payload.task_id}", value=f"{rating_message.message_id}")
         return {"ok": True}
     except Exception as e:
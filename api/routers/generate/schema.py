@@ -9,18 +9,27 @@ class GenerateTextIn(BaseModel):
     chat_id: str
     prompt: str
     aspect_ratio: str
+    # True — «другой вариант»: готовое видео из кэша не подходит
+    fresh: bool = False
 
 class GeneratePhotoIn(BaseModel):
     chat_id: str
     prompt: str
     image_url: Optional[str] = None
     aspect_ratio: str
+    fresh: bool = False
 
 class GenerateOut(BaseModel):
     ok: bool
     task_id: str
     input_image_url: Optional[str] = None
     raw: Optional[dict] = None
+    cached: bool = False
+    result_url: Optional[str] = None
+
+class QueueOut(BaseModel):
+    depth: int
+    position: Optional[int] = None
 
 class StatusOut(BaseModel):
     ok: bool
@@ -58,4 +67,9 @@ class VideoReadyIn(BaseModel):
     task_id: str
     result_url: str | None = None
     source_url: str | None = None
-    fallback: bool | None = None
\ No newline at end of file
+    fallback: bool | None = None
+
+class VideoFailedIn(BaseModel):
+    chat_id: str
+    task_id: str
+    reason: str | None = None
@@ -1,17 +1,34 @@
-from fastapi import Request
-from aiogram.types import Update
+from fastapi import HTTPException, Request, status
 from bot.manager import bot_manager
+from bot.updates import parse_update
 
 class SystemRoutesManager:
     def __init__(self):
         self.bot_dp = bot_manager.dp
         self.bot = bot_manager.bot
+        self.updates = bot_manager.updates
+        self.dedup = bot_manager.dedup
         self.api_manager = None
     
     async def webhook_updates(self, request: Request):
-        data = await request.json()
-        update = Update(**data)
-        await self.bot_dp.feed_update(self.bot, update)
+        update = parse_update(await request.body(), self.bot)
+        # повторная доставка того же апдейта (наш ответ был медленным) — не гоняем хэндлеры второй раз
+        if await self.dedup.is_duplicate(update.update_id):
+            return {"ok": True}
+        # в режиме очереди отвечаем Telegram сразу
+        if self.updates is not None and self.updates.running:
+            if self.updates.put(update):
+                return {"ok": True}
+            # очередь переполнена: без очереди нарушим порядок апдейтов чата —
+            # отказываем, и Telegram доставит апдейт повторно
+            await self.dedup.forget(update.update_id)
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Update queue is full")
+        try:
+            await self.bot_dp.feed_update(self.bot, update)
+        except Exception:
+            # Telegram пришлёт апдейт снова — пусть он обработается
+            await self.dedup.forget(update.update_id)
+            raise
         return {"ok": True}
     
     def get_app(self):
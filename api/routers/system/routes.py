@@ -8,10 +8,12 @@ from api.routers.system import SystemRoutesManager
 from api.routers.system.schemas import BotMessage
 from api.security import require_bot_service
 from bot.manager import bot_manager
+from bot.media import media
+from bot.outbound import Priority, outbound_priority
 from sqlalchemy.ext.asyncio import AsyncSession
 from scalar_fastapi import get_scalar_api_reference
-from aiogram import types
 from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from utils.metrics import metrics
 
 router = APIRouter()
 
@@ -39,6 +41,22 @@ def check_health():
     return {"ok": True}
 
 
+@router.get(
+    "/metrics",
+    summary="Метрики процесса",
+    dependencies=[Depends(require_bot_service)]
+)
+def get_metrics():
+    """
+    Снимок счётчиков, гауг и таймингов текущего процесса (кэш бэкенда, очереди, внешние вызовы).
+
+    > [!important]
+    > Заголовки запроса:
+    > - `X-API-KEY: str` - API ключ для аутентификации (обязательный)
+    """
+    return metrics.snapshot()
+
+
 @router.get("/scalar", include_in_schema=False)
 def get_scalar():
     app = SRM.get_app()
@@ -62,16 +80,16 @@ async def _send(dto: "BotMessage", chat_id: int):
     # Валидация доступа/существования
     chat = await bot_manager.bot.get_chat(chat_id)
 
+    # медиа уходят по file_id из реестра: Telegram забирает файл по ссылке только один раз
     if dto.img_url and not dto.video_url:
-        await bot_manager.bot.send_photo(chat_id=chat_id, photo=dto.img_url, caption=dto.text or None)
+        await media.send(bot_manager.bot, "photo", chat_id, dto.img_url, caption=dto.text or None)
     elif dto.video_url and not dto.img_url:
-        await bot_manager.bot.send_video(chat_id=chat_id, video=dto.video_url, caption=dto.text or None)
+        await media.send(bot_manager.bot, "video", chat_id, dto.video_url, caption=dto.text or None)
     elif dto.img_url and dto.video_url:
-        media = [
-            types.InputMediaPhoto(media=dto.img_url, caption=dto.text or None),
-            types.InputMediaVideo(media=dto.video_url),
-        ]
-        await bot_manager.bot.send_media_group(chat_id=chat_id, media=media)
+        await media.send_media_group(bot_manager.bot, chat_id, [
+            ("photo", dto.img_url, dto.text or None),
+            ("video", dto.video_url, None),
+        ])
     else:
         await bot_manager.bot.send_message(chat_id=chat_id, text=dto.text)
 
@@ -102,7 +120,7 @@ async def post_message(
     failures = []
     sent = 0
 
-    # Ограничим параллелизм, чтобы не ловить 429
+    # Темп задаёт планировщик исходящих; семафор лишь ограничивает число ожидающих задач
     sem = asyncio.Semaphore(20)
 
     async def _safe_send(cid: int):
@@ -131,7 +149,9 @@ async def post_message(
         except Exception as e:
             failures.append((cid, f"{type(e).__name__}: {e!r}"))
 
-    await asyncio.gather(*[_safe_send(cid) for cid in norm_ids])
+    # рассылка уступает доставке видео, ответам и прогрессу
+    with outbound_priority(Priority.BROADCAST):
+        await asyncio.gather(*[_safe_send(cid) for cid in norm_ids])
 
     # Возвращаем аккуратный ответ (и можно ещё это логировать)
     return {
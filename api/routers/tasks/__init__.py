@@ -1,4 +1,9 @@
 from api.crud.task import TaskCRUD
+from services.estimator import DurationEstimator
+from services.redis import RedisClient
 
 def get_task_crud() -> TaskCRUD:
-    return TaskCRUD()
\ No newline at end of file
+    return TaskCRUD()
+
+def get_estimator() -> DurationEstimator:
+    return DurationEstimator(TaskCRUD(), RedisClient())
@@ -5,7 +5,9 @@ from api.crud.task import TaskCRUD
 from api.crud.task.schema import TaskCreate, TaskRead
 from api.database import get_async_session 
 from typing import List, Dict, Any
-from . import get_task_crud
+from . import get_estimator, get_task_crud
+from services.estimator import DurationEstimator
+from utils.estimates import DEFAULT_ESTIMATE
 
 router = APIRouter()
 
@@ -46,6 +48,37 @@ async def create_task(
         logging.error(e)
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get(
+        "/estimates",
+        response_model=Dict[str, Any],
+        summary="Оценка длительности генерации"
+        )
+async def get_estimates(
+    session: AsyncSession = Depends(get_async_session),
+    estimator: DurationEstimator = Depends(get_estimator),
+):
+    """
+    Оценка времени генерации видео (отправка в KIE → колбэк) по истории задач.
+
+    Cтатус запроса:
+    - 200 OK - оценки возвращены
+    - 500 Internal Server Error - ошибка сервера
+
+    > [!important]
+    > Заголовки запроса:
+    > - `X-API-KEY: str` - API ключ для аутентификации (обязательный)
+
+    Выходные данные:
+    - `estimates: dict` - по ключам `"{mode}:{aspect_ratio}"`, `"{mode}:*"` и `"*"`:
+      `p50`, `p90` (секунды) и `samples`; группы с малым числом задач не выводятся
+    - `default: dict` - оценка, если подходящей группы нет
+    """
+    try:
+        return {"estimates": await estimator.estimates(session), "default": DEFAULT_ESTIMATE}
+    except Exception as e:
+        logging.error(e)
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get(
         "/{task_id}", 
         response_model=TaskRead,
@@ -0,0 +1,63 @@
+"""
+Задержка одного вызова BackendAPI: транспорт "http" против "asgi".
+
+Для режима http сервер должен быть запущен (BASE_URL из .env), asgi работает в процессе.
+По умолчанию дёргается /check-health — чистая стоимость транспорта без БД;
+с --chat-id меряется реальный GET /users/{chat_id}/coins.
+
+    uv run python -m benchmarks.backend_transport --calls 500
+    uv run python -m benchmarks.backend_transport --calls 500 --chat-id 123456 --modes asgi
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import statistics
+import time
+
+from bot.api import TRANSPORTS, BackendAPI
+from config import ENV
+
+
+def _percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    idx = min(len(values) - 1, max(0, round(q * (len(values) - 1))))
+    return values[idx]
+
+
+async def _bench(mode: str, path: str, calls: int, warmup: int) -> list[float]:
+    env = ENV()
+    backend = BackendAPI(env.bot_api_token, transport=mode)
+    try:
+        for _ in range(warmup):
+            await backend._request("GET", path)
+        timings = []
+        for _ in range(calls):
+            started = time.perf_counter()
+            await backend._request("GET", path)
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
+    finally:
+        await backend.aclose()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--chat-id", type=str, default=None)
+    parser.add_argument("--modes", nargs="+", choices=TRANSPORTS, default=list(TRANSPORTS))
+    args = parser.parse_args()
+
+    path = f"/users/{args.chat_id}/coins" if args.chat_id else "/check-health"
+    print(f"GET {path}, {args.calls} calls per mode\n")
+    print(f"{'mode':<6} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'calls/s':>9}")
+    for mode in args.modes:
+        t = await _bench(mode, path, args.calls, args.warmup)
+        print(
+            f"{mode:<6} {statistics.fmean(t):>9.3f} {_percentile(t, 0.5):>9.3f} "
+            f"{_percentile(t, 0.95):>9.3f} {_percentile(t, 0.99):>9.3f} {1000 * len(t) / sum(t):>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+"""
+Пропускная способность воркера Celery на накладных расходах одной задачи:
+старый путь против постоянного контекста процесса.
+
+  per-job    — asyncio.run + новый набор сервисов + закрытие пулов на каждую задачу, как было
+  persistent — один event loop и сервисы WorkerContext на процесс
+
+Задача — то, что делает колбэк до скачивания видео: проверка состояния veo:cb:{taskId}
+в Redis (taskId заранее помечен done, поэтому обработка сразу возвращает результат)
+и запрос к БД. Нужны Redis и Postgres из .env; брокер не нужен — задачи вызываются напрямую.
+
+    uv run python -m benchmarks.celery_worker --jobs 300
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import text
+
+from api.database import async_session_maker, engine
+from services.bground.tasks import _make_service
+from services.bground.worker import WorkerContext
+from services.veo import VeoService
+
+TASK_ID = "bench-celery-worker"
+PAYLOAD = {"code": 200, "msg": "bench", "data": {"taskId": TASK_ID, "info": {}}}
+
+
+async def _job(svc: VeoService) -> None:
+    async with async_session_maker() as session:
+        await session.execute(text("SELECT 1"))
+        await svc.process_callback(PAYLOAD, session)
+
+
+def _per_job() -> None:
+    async def _run():
+        svc = _make_service()
+        try:
+            await _job(svc)
+        finally:
+            await svc.gen.close()
+            await svc.redis.redis.aclose()
+            await engine.dispose()
+
+    asyncio.run(_run())
+
+
+def _bench(run, jobs: int, warmup: int) -> list[float]:
+    for _ in range(warmup):
+        run()
+    timings = []
+    for _ in range(jobs):
+        started = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def _report(mode: str, t: list[float]) -> None:
+    print(f"{mode:<11} {statistics.fmean(t):>9.3f} {statistics.median(t):>9.3f} {1000 * len(t) / sum(t):>9.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=10)
+    args = parser.parse_args()
+
+    async def _prepare(svc: VeoService):
+        await svc.redis.callback_receive(TASK_ID)
+        await svc.redis.callback_done(TASK_ID, {"task_id": TASK_ID, "status": "success"}, ttl=3600)
+
+    ctx = WorkerContext(_make_service)
+    ctx.run(_prepare(ctx.svc))
+
+    print(f"{args.jobs} jobs per mode\n")
+    print(f"{'mode':<11} {'mean ms':>9} {'p50 ms':>9} {'jobs/s':>9}")
+    try:
+        _report("persistent", _bench(lambda: ctx.run(_job(ctx.svc)), args.jobs, args.warmup))
+        ctx.run(engine.dispose())
+        _report("per-job", _bench(_per_job, args.jobs, args.warmup))
+    finally:
+        ctx.run(ctx.svc.redis.callback_forget(TASK_ID))
+        ctx.close()
+
+
+if __name__ == "__main__":
+    main()
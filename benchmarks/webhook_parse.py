@@ -0,0 +1,85 @@
+"""
+CPU на разбор одного апдейта вебхука: старый путь против parse_update.
+
+  old    — json.loads(body) + Update(**data), как было в webhook_updates
+  orjson — orjson.loads(body) + Update.model_validate(data) (если orjson установлен)
+  bytes  — Update.model_validate_json(body) через bot.updates.parse_update
+
+Корпус — записанные апдейты (сообщения, колбэки, фото, платежи):
+benchmarks/data/telegram_updates.json
+
+    uv run python -m benchmarks.webhook_parse --rounds 2000
+"""
+from __future__ import annotations
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Callable
+
+from aiogram.types import Update
+
+from bot.updates import parse_update
+
+CORPUS = Path(__file__).parent / "data" / "telegram_updates.json"
+
+
+def _old(body: bytes) -> Update:
+    data = json.loads(body)
+    return Update(**data)
+
+
+def _bytes(body: bytes) -> Update:
+    return parse_update(body)
+
+
+def _variants() -> dict[str, Callable[[bytes], Update]]:
+    variants = {"old": _old, "bytes": _bytes}
+    try:
+        import orjson
+    except ImportError:
+        return variants
+    variants["orjson"] = lambda body: Update.model_validate(orjson.loads(body))
+    return variants
+
+
+def _kind(update: Update) -> str:
+    try:
+        return update.event_type
+    except Exception:
+        return "unknown"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    bodies = [json.dumps(u, ensure_ascii=False).encode() for u in json.loads(CORPUS.read_text("utf-8"))]
+    variants = _variants()
+
+    # одинаковый результат у всех вариантов — иначе сравнивать нечего
+    for body in bodies:
+        reference = _old(body).model_dump(exclude_none=True)
+        for name, fn in variants.items():
+            assert fn(body).model_dump(exclude_none=True) == reference, f"{name} differs on {body[:60]!r}"
+
+    print(f"{len(bodies)} payloads x {args.rounds} rounds\n")
+    print(f"{'kind':<20}" + "".join(f"{name + ' µs':>12}" for name in variants))
+    totals = dict.fromkeys(variants, 0.0)
+    for body in bodies:
+        row = f"{_kind(_old(body)):<20}"
+        for name, fn in variants.items():
+            started = time.perf_counter()
+            for _ in range(args.rounds):
+                fn(body)
+            per_call = (time.perf_counter() - started) / args.rounds * 1e6
+            totals[name] += per_call
+            row += f"{per_call:>12.1f}"
+        print(row)
+    print(f"{'mean':<20}" + "".join(f"{totals[name] / len(bodies):>12.1f}" for name in variants))
+    print(f"\nbytes vs old: {100 * (1 - totals['bytes'] / totals['old']):.1f}% less CPU per update")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,16 @@
 from __future__ import annotations
 from datetime import datetime
 import json
-from typing import List, Optional, TypedDict
+from typing import List, Literal, Optional, Tuple, TypedDict
 import asyncio
 import httpx
 import logging
 from dataclasses import dataclass
 
+from bot.api.cache import MISS, BackendCache, backend_cache
 from config import ENV
+from utils.estimates import pick_estimate
+from utils.metrics import metrics
 
 
 # --- Типы результатов ---
@@ -16,6 +19,13 @@ class RegisterResult(TypedDict, total=False):
     created: bool
     reason: str  # "exists" и т.п.
 
+class BootstrapResult(TypedDict):
+    created: bool
+    coins: int
+    role: Literal["user", "partner"]
+    ref_code: Optional[str]
+    ref_link: Optional[str]
+
 class BackendError(Exception): ...
 class BackendAuthError(BackendError): ...
 class BackendNotFound(BackendError): ...
@@ -33,10 +43,18 @@ class RetryConfig:
     retry_for_status: tuple[int, ...] = (502, 503, 504)  # временные ошибки
 
 
+TRANSPORTS = ("http", "asgi")
+
+
 class BackendAPI:
     """
     Клиент для api.skyrodev.ru (бот-интерфейс).
     Авторизация: заголовок X-Api-Key (service-to-service).
+
+    Транспорт:
+      - "http" — обычные запросы по сети (бот и API развёрнуты раздельно);
+      - "asgi" — запросы уходят прямо в FastAPI-приложение этого же процесса,
+        без TCP и uvicorn. Маршруты, авторизация и мэппинг ошибок те же.
     """
     env = ENV()
     def __init__(
@@ -45,21 +63,39 @@ class BackendAPI:
         base_url: str = env.BASE_URL,
         timeout: float = 120.0,
         retry: RetryConfig | None = None,
+        transport: str | None = None,
+        cache: BackendCache | None = None,
     ):
         self.base_url = base_url.rstrip("/")
         self.api_key = api_key
         self.timeout = timeout
         self.retry = retry or RetryConfig()
+        self.transport = (transport or self.env.backend_transport).lower()
+        if self.transport not in TRANSPORTS:
+            raise ValueError(f"Unknown backend transport: {self.transport!r}, expected one of {TRANSPORTS}")
+        self.cache = cache or backend_cache
         self._client: Optional[httpx.AsyncClient] = None
+        # single-flight: одинаковые GET, пришедшие одновременно, ждут один запрос
+        self._inflight: dict[str, asyncio.Task] = {}
 
     # ---------- infra ----------
 
+    def _make_transport(self) -> Optional[httpx.AsyncBaseTransport]:
+        if self.transport == "http":
+            return None
+        # импорт здесь, а не наверху: api.app → system routes → bot.manager → bot.routers → bot.api
+        from api.routers.system.routes import SRM
+        # raise_app_exceptions=False: необработанное исключение в роуте превращается в 500,
+        # как и по сети, и дальше мэппится в BackendServerError
+        return httpx.ASGITransport(app=SRM.get_app(), raise_app_exceptions=False)
+
     async def _ensure_client(self) -> httpx.AsyncClient:
         if self._client is None:
             self._client = httpx.AsyncClient(
                 base_url=self.base_url,
                 timeout=self.timeout,
                 headers={"X-Api-Key": self.api_key},
+                transport=self._make_transport(),
             )
         return self._client
 
@@ -92,6 +128,34 @@ class BackendAPI:
         *,
         json: dict | None = None,
         expected: tuple[int, ...] = (200,),
+    ) -> httpx.Response:
+        if method.upper() != "GET" or json is not None:
+            return await self._send(method, url, json=json, expected=expected)
+        key = f"GET {url} {expected}"
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._send(method, url, expected=expected))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget_inflight(key, t))
+            metrics.inc("backend.singleflight.leader")
+        else:
+            metrics.inc("backend.singleflight.collapsed")
+        # shield: отмена одного из ждущих не отменяет общий запрос для остальных
+        return await asyncio.shield(task)
+
+    def _forget_inflight(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # помечаем исключение как полученное, даже если все ждущие отменились
+
+    async def _send(
+        self,
+        method: str,
+        url: str,
+        *,
+        json: dict | None = None,
+        expected: tuple[int, ...] = (200,),
     ) -> httpx.Response:
         client = await self._ensure_client()
         attempt = 0
@@ -170,20 +234,55 @@ class BackendAPI:
             return {"created": False, "reason": "exists"}
         return await self.register_user(chat_id, nickname)
 
+    async def bootstrap(self, chat_id: int, nickname: Optional[str] = None) -> BootstrapResult:
+        """
+        Один запрос на вход пользователя: при необходимости регистрирует и сразу
+        возвращает баланс, роль и реферальную ссылку.
+        """
+        payload = {"nickname": (nickname or f"user_{chat_id}")[:64]}
+        resp = await self._request("POST", f"/users/{chat_id}/bootstrap", json=payload, expected=(200,))
+        data = resp.json()
+        await self.cache.set_coins(chat_id, int(data.get("coins") or 0))
+        return {
+            "created": bool(data.get("created")),
+            "coins": int(data.get("coins") or 0),
+            "role": data.get("role") or "user",
+            "ref_code": data.get("ref_code"),
+            "ref_link": data.get("ref_link"),
+        }
+
     async def get_user(self, chat_id: int) -> dict:
         """
         Возвращает UserRead как dict (id, nickname, chat_id, coins, token?).
         """
+        key = self.cache.user_key(chat_id)
+        cached = await self.cache.get(key)
+        if cached is not MISS:
+            return dict(cached)
         resp = await self._request("GET", f"/users/{chat_id}", expected=(200,))
-        return resp.json()
+        data = resp.json()
+        await self.cache.set(key, data)
+        return data
 
     async def get_coins(self, chat_id: int) -> int:
         """
-        Возвращает текущие coins.
+        Возвращает текущие coins (из кэша, если свежие).
         """
+        key = self.cache.coins_key(chat_id)
+        cached = await self.cache.get(key)
+        if cached is not MISS:
+            return int(cached)
         resp = await self._request("GET", f"/users/{chat_id}/coins", expected=(200,))
         data = resp.json()
-        return int(data.get("coins", 0))
+        coins = int(data.get("coins", 0))
+        await self.cache.set(key, coins)
+        return coins
+
+    async def invalidate_user(self, chat_id: int) -> None:
+        """
+        Сбрасывает закэшированные баланс и профиль пользователя.
+        """
+        await self.cache.invalidate(chat_id)
 
     async def minus_coin(self, chat_id: int) -> int:
         """
@@ -192,7 +291,9 @@ class BackendAPI:
         """
         payload = {"chat_id": str(chat_id)}
         resp = await self._request("POST", "/users/coins/minus", json=payload, expected=(200,))
-        return int(resp.json().get("coins", 0))
+        coins = int(resp.json().get("coins", 0))
+        await self.cache.set_coins(chat_id, coins)
+        return coins
 
     async def plus_coins(self, chat_id: int, count: int) -> int:
         """
@@ -202,12 +303,18 @@ class BackendAPI:
             raise ValueError("count must be > 0")
         payload = {"chat_id": str(chat_id), "count": int(count)}
         resp = await self._request("POST", "/users/coins/plus", json=payload, expected=(200,))
-        return int(resp.json().get("coins", 0))
+        coins = int(resp.json().get("coins", 0))
+        await self.cache.set_coins(chat_id, coins)
+        return coins
     
 
-    async def generate_text(self, chat_id: int, prompt: str, aspect_ratio: str = "16:9") -> dict:
-        payload = {"chat_id": chat_id, "prompt": prompt, "aspect_ratio": aspect_ratio}
-        resp = await self._request("POST", "/bot/veo/generate/text", json=payload, expected=(200,))
+    async def generate_text(self, chat_id: int, prompt: str, aspect_ratio: str = "16:9", fresh: bool = False) -> dict:
+        payload = {"chat_id": chat_id, "prompt": prompt, "aspect_ratio": aspect_ratio, "fresh": fresh}
+        # бэкенд списывает монету (или возвращает её при ошибке) — баланс перечитаем
+        try:
+            resp = await self._request("POST", "/bot/veo/generate/text", json=payload, expected=(200,))
+        finally:
+            await self.cache.invalidate(chat_id)
         return resp.json()
 
 
@@ -219,20 +326,23 @@ class BackendAPI:
         image_url: str | None = None,
         filename: str = "image.jpg",
         aspect_ratio: str = "16:9",
+        fresh: bool = False,
     ) -> dict:
         client = await self._ensure_client()
 
         if image_url:
             # если URL уже есть, отправляем JSON без файлов
-            payload = {"chat_id": str(chat_id), "prompt": prompt, "image_url": image_url, "aspect_ratio": aspect_ratio}
+            payload = {"chat_id": str(chat_id), "prompt": prompt, "image_url": image_url, "aspect_ratio": aspect_ratio, "fresh": fresh}
             print(payload)
             resp = await self._request("POST", "/bot/veo/generate/photo", json=payload, expected=(200, 400, 401))
         else:
             # иначе отправляем multipart с байтами изображения
             files = {"image": (filename, file_bytes)}
-            data = {"chat_id": str(chat_id), "prompt": prompt, "aspect_ratio": aspect_ratio}
+            data = {"chat_id": str(chat_id), "prompt": prompt, "aspect_ratio": aspect_ratio, "fresh": fresh}
             resp = await self._request("POST", "/bot/veo/generate/photo", json=data, files=files, expected=(200, 400, 401))
 
+        # бэкенд списал монету (или вернул её при ошибке) — баланс перечитаем
+        await self.cache.invalidate(chat_id)
         if resp.status_code == 200:
             return resp.json()
         if resp.status_code == 400:
@@ -308,6 +418,28 @@ class BackendAPI:
         resp = await self._request("GET", f"/tasks/{task_id}", expected=(200,))
         return resp.json()
     
+    async def get_estimates(self) -> dict:
+        """
+        Оценки длительности генерации {"estimates": {...}, "default": {...}}.
+        Меняются медленно, поэтому кэшируются дольше баланса.
+        """
+        cached = await self.cache.get("estimates")
+        if cached is not MISS:
+            return cached
+        resp = await self._request("GET", "/tasks/estimates", expected=(200,))
+        data = resp.json()
+        await self.cache.set("estimates", data, ttl=300)
+        return data
+
+    async def get_estimate(self, mode: Optional[str], aspect_ratio: Optional[str]) -> Tuple[float, float]:
+        """(p50, p90) в секундах; при недоступном API — оценка по умолчанию."""
+        try:
+            data = await self.get_estimates()
+        except Exception as e:
+            logging.warning("estimates unavailable: %s", e)
+            data = {}
+        return pick_estimate(data.get("estimates") or {}, mode, aspect_ratio)
+
     async def get_sbp_url(self, amount: str, desc: str) -> Optional[str]:
         payload = {
             "amount": amount,
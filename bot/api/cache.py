@@ -0,0 +1,146 @@
+from __future__ import annotations
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from config import ENV
+from utils.metrics import metrics
+
+
+MISS = object()
+
+
+class TTLCache:
+    """
+    Ограниченный по размеру LRU-кэш с TTL на запись. Только для одного event loop.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 15.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return MISS
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return MISS
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class BackendCache:
+    """
+    Кэш профиля и баланса для BackendAPI.
+
+    Локальный уровень — TTLCache процесса. Опционально второй, общий уровень в Redis
+    (backend_cache_redis=True), чтобы инвалидация с сервера (возврат монеты и т.п.)
+    была видна всем воркерам. Локальный TTL короткий: между процессами он и есть
+    верхняя граница устаревания.
+    """
+    PREFIX = "bot:cache:"
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 15.0, use_redis: bool = False):
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.ttl = ttl
+        self.use_redis = use_redis
+        self._redis = None
+        self.hits = 0
+        self.misses = 0
+        metrics.gauge("backend.cache.size", lambda: len(self.local))
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            from services.redis import RedisClient
+            self._redis = RedisClient()
+        return self._redis
+
+    @staticmethod
+    def coins_key(chat_id: int | str) -> str:
+        return f"coins:{chat_id}"
+
+    @staticmethod
+    def user_key(chat_id: int | str) -> str:
+        return f"user:{chat_id}"
+
+    async def get(self, key: str) -> Any:
+        value = self.local.get(key)
+        if value is MISS and self.use_redis:
+            try:
+                shared = await self.redis.get_json(self.PREFIX + key)
+            except Exception as e:
+                logging.warning("backend cache: redis get failed: %s", e)
+                shared = None
+            if shared is not None:
+                self.local.set(key, shared)
+                value = shared
+        if value is MISS:
+            self.misses += 1
+            metrics.inc("backend.cache.miss")
+            return MISS
+        self.hits += 1
+        metrics.inc("backend.cache.hit")
+        return value
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        self.local.set(key, value, ttl=ttl)
+        if self.use_redis:
+            try:
+                await self.redis.set_json(self.PREFIX + key, value, ttl=max(1, int(ttl)))
+            except Exception as e:
+                logging.warning("backend cache: redis set failed: %s", e)
+
+    async def set_coins(self, chat_id: int | str, coins: int) -> None:
+        await self.set(self.coins_key(chat_id), coins)
+        # в профиле тоже лежат coins — проще перечитать его при следующем запросе
+        await self._drop(self.user_key(chat_id))
+
+    async def invalidate(self, chat_id: int | str) -> None:
+        await self._drop(self.coins_key(chat_id), self.user_key(chat_id))
+        metrics.inc("backend.cache.invalidate")
+
+    async def _drop(self, *keys: str) -> None:
+        for key in keys:
+            self.local.pop(key)
+        if self.use_redis:
+            try:
+                await self.redis.delete(*(self.PREFIX + key for key in keys))
+            except Exception as e:
+                logging.warning("backend cache: redis delete failed: %s", e)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self.local),
+        }
+
+
+_env = ENV()
+# общий для всех экземпляров BackendAPI процесса: иначе оплата в payment-роутере
+# не была бы видна кэшу основного роутера
+backend_cache = BackendCache(
+    maxsize=_env.backend_cache_size,
+    ttl=_env.backend_cache_ttl,
+    use_redis=_env.backend_cache_redis,
+)
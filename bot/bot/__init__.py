@@ -1,9 +1,16 @@
 from __future__ import annotations
 
 from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
 from config import ENV
 from bot import routers
 from bot.routers.payment import router as payment_router
+from bot.fsm.storage import HashRedisStorage
+from bot.outbound import OutboundScheduler
+from utils.progress import progress
+from bot.updates import UpdateDeduplicator, UpdateQueue
+from services.redis import RedisClient
 # from bot.routers.prompts import router as prompts_router
 import asyncio
 from aiogram.exceptions import TelegramRetryAfter
@@ -12,10 +19,40 @@ class BotManager:
     def __init__(self):
         self.env = ENV()
         self.bot = Bot(token=self.env.BOT_TOKEN)
-        self.dp = Dispatcher()
+        # все отправки бота идут через общий планировщик с лимитами Telegram
+        self.outbound = OutboundScheduler(
+            global_rate=self.env.tg_global_rate,
+            chat_rate=self.env.tg_chat_rate,
+            chat_burst=self.env.tg_chat_burst,
+        )
+        self.bot.session.middleware(self.outbound)
+        self.dp = Dispatcher(storage=self._make_fsm_storage())
         self.webhook_endpoint = self.env.webhook_endpoint
+        self.updates = self._make_update_queue()
+        self.dedup = UpdateDeduplicator(backend=self.env.webhook_dedup, ttl=self.env.webhook_dedup_ttl)
         self.add_routes()
 
+    def _make_fsm_storage(self) -> BaseStorage:
+        storage = self.env.fsm_storage
+        if storage == "memory":
+            return MemoryStorage()
+        if storage == "redis":
+            # те же настройки подключения, что и у остального Redis приложения
+            return HashRedisStorage(RedisClient().redis, ttl=self.env.fsm_ttl)
+        raise ValueError(f"Unknown FSM storage: {storage!r}, expected 'memory' or 'redis'")
+
+    def _make_update_queue(self) -> UpdateQueue | None:
+        mode = self.env.webhook_mode
+        if mode == "inline":
+            return None
+        if mode == "queue":
+            return UpdateQueue(
+                self.dp, self.bot,
+                workers=self.env.webhook_workers,
+                max_pending=self.env.webhook_queue_size,
+            )
+        raise ValueError(f"Unknown webhook mode: {mode!r}, expected 'inline' or 'queue'")
+
     def add_routes(self):
         # self.dp.include_router(prompts_router)
         if routers.router.parent_router is None:
@@ -23,6 +60,9 @@ class BotManager:
         self.dp.include_router(payment_router)
 
     async def bot_start(self):
+        if self.updates is not None:
+            await self.updates.start()
+        progress.start_sweeper(self.bot)
         try:
             await self.bot.set_webhook(self.webhook_endpoint)
         except TelegramRetryAfter as e:
@@ -31,5 +71,9 @@ class BotManager:
 
     async def bot_stop(self):
         await self.bot.delete_webhook()
+        if self.updates is not None:
+            await self.updates.stop()
+        await progress.close()
+        await self.dp.storage.close()
         await self.bot.session.close()
 
@@ -0,0 +1,66 @@
+from __future__ import annotations
+import json
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.redis import RedisStorage
+from redis.asyncio import Redis
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class HashRedisStorage(RedisStorage):
+    """
+    FSM-хранилище в Redis, общее для всех воркеров.
+
+    Состояние хранится как в RedisStorage, а данные — hash'ем, по полю на ключ
+    (prompt_last, image_url, ...). Поэтому update_data не читает-пишет весь dict,
+    а делает HSET + EXPIRE + HGETALL одним пайплайном — один round trip,
+    и параллельные update_data по разным ключам не затирают друг друга.
+    """
+
+    def __init__(self, redis: Redis, ttl: Optional[int] = None):
+        super().__init__(redis, state_ttl=ttl, data_ttl=ttl)
+
+    def _data_key(self, key: StorageKey) -> str:
+        return self.key_builder.build(key, "data")
+
+    @staticmethod
+    def _decode(raw: Mapping[Any, Any]) -> Dict[str, Any]:
+        data = {}
+        for field, value in raw.items():
+            if isinstance(field, bytes):
+                field = field.decode("utf-8")
+            data[field] = json.loads(value)
+        return data
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        redis_key = self._data_key(key)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(redis_key)
+            if data:
+                pipe.hset(redis_key, mapping={k: _dumps(v) for k, v in data.items()})
+                if self.data_ttl:
+                    pipe.expire(redis_key, self.data_ttl)
+            await pipe.execute()
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return self._decode(await self.redis.hgetall(self._data_key(key)))
+
+    async def get_value(self, storage_key: StorageKey, dict_key: str, default: Optional[Any] = None) -> Optional[Any]:
+        raw = await self.redis.hget(self._data_key(storage_key), dict_key)
+        return default if raw is None else json.loads(raw)
+
+    async def update_data(self, key: StorageKey, data: Mapping[str, Any]) -> Dict[str, Any]:
+        if not data:
+            return await self.get_data(key)
+        redis_key = self._data_key(key)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(redis_key, mapping={k: _dumps(v) for k, v in data.items()})
+            if self.data_ttl:
+                pipe.expire(redis_key, self.data_ttl)
+            pipe.hgetall(redis_key)
+            result = await pipe.execute()
+        return self._decode(result[-1])
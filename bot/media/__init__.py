@@ -0,0 +1,143 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import logging
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from aiogram import Bot, types
+from aiogram.exceptions import TelegramBadRequest
+
+from services.redis import RedisClient
+from utils.metrics import metrics
+
+
+def media_digest(url: str) -> str:
+    """Ключ медиа по ссылке без query: у presigned URL одного объекта меняется только подпись."""
+    parts = urlsplit(url)
+    return hashlib.sha256(f"{parts.netloc}{parts.path}".encode()).hexdigest()[:32]
+
+
+def _file_id(message: types.Message, kind: str) -> Optional[str]:
+    if kind == "photo" and message.photo:
+        return message.photo[-1].file_id
+    if kind == "video" and message.video:
+        return message.video.file_id
+    return None
+
+
+def _stale(e: TelegramBadRequest) -> bool:
+    # "wrong file identifier", "file reference expired" и т.п.
+    return "file" in str(e.message).lower()
+
+
+class MediaRegistry:
+    """
+    Реестр загруженных в Telegram медиа: ссылка на объект (S3 и т.п.) -> file_id.
+
+    Первая отправка идёт по ссылке (upload=True — файл качает и заливает наш процесс,
+    иначе Telegram забирает его сам), из ответа запоминается file_id, и все следующие
+    отправки того же файла — короткий вызов API без передачи данных. Одновременные
+    первые отправки одного файла (рассылка) ждут первую загрузку, а не грузят его
+    параллельно. Протухший file_id удаляется, и медиа отправляется по ссылке заново.
+    """
+    TTL = 30 * 24 * 3600
+
+    def __init__(self, redis: Optional[RedisClient] = None):
+        self._redis = redis
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    @property
+    def redis(self) -> RedisClient:
+        if self._redis is None:
+            self._redis = RedisClient()
+        return self._redis
+
+    async def _lookup(self, kind: str, digest: str) -> Optional[str]:
+        try:
+            return await self.redis.get_media_id(kind, digest)
+        except Exception as e:
+            logging.warning("media registry lookup failed: %s", e)
+            return None
+
+    async def _remember(self, kind: str, digest: str, file_id: str) -> None:
+        try:
+            await self.redis.set_media_id(kind, digest, file_id, ttl=self.TTL)
+        except Exception as e:
+            logging.warning("media registry write failed: %s", e)
+
+    @staticmethod
+    async def _send(bot: Bot, kind: str, chat_id, media, **kwargs) -> types.Message:
+        if kind == "video":
+            return await bot.send_video(chat_id=chat_id, video=media, **kwargs)
+        return await bot.send_photo(chat_id=chat_id, photo=media, **kwargs)
+
+    async def send(self, bot: Bot, kind: str, chat_id, url: str, *, upload: bool = False, **kwargs) -> types.Message:
+        """Отправляет photo/video по file_id из реестра, а без него — по ссылке, запоминая file_id."""
+        digest = media_digest(url)
+        key = f"{kind}:{digest}"
+        file_id = await self._lookup(kind, digest)
+        if file_id is None and key in self._pending:
+            file_id = await asyncio.shield(self._pending[key])
+        if file_id:
+            metrics.inc("media.hit")
+            try:
+                return await self._send(bot, kind, chat_id, file_id, **kwargs)
+            except TelegramBadRequest as e:
+                if not _stale(e):
+                    raise
+                metrics.inc("media.stale")
+                await self.redis.forget_media_id(kind, digest)
+
+        metrics.inc("media.miss")
+        fut = None
+        if key not in self._pending:
+            fut = self._pending[key] = asyncio.get_running_loop().create_future()
+        new_id = None
+        try:
+            with metrics.timer(f"media.upload.{kind}"):
+                message = await self._send(bot, kind, chat_id, types.URLInputFile(url) if upload else url, **kwargs)
+            new_id = _file_id(message, kind)
+            if new_id:
+                await self._remember(kind, digest, new_id)
+            return message
+        finally:
+            if fut is not None:
+                self._pending.pop(key, None)
+                fut.set_result(new_id)
+
+    async def send_media_group(self, bot: Bot, chat_id, items: List[Tuple[str, str, Optional[str]]]) -> List[types.Message]:
+        """items — (kind, url, caption); известные медиа уходят по file_id."""
+        digests = [media_digest(url) for _, url, _ in items]
+        cached = [await self._lookup(kind, digest) for (kind, _, _), digest in zip(items, digests)]
+
+        def _build(use_cache: bool):
+            media = []
+            for (kind, url, caption), file_id in zip(items, cached):
+                source = (file_id if use_cache else None) or url
+                cls = types.InputMediaVideo if kind == "video" else types.InputMediaPhoto
+                media.append(cls(media=source, caption=caption))
+            return media
+
+        use_cache = any(cached)
+        try:
+            messages = await bot.send_media_group(chat_id=chat_id, media=_build(use_cache))
+        except TelegramBadRequest as e:
+            if not use_cache or not _stale(e):
+                raise
+            metrics.inc("media.stale")
+            for (kind, _, _), digest, file_id in zip(items, digests, cached):
+                if file_id:
+                    await self.redis.forget_media_id(kind, digest)
+            cached = [None] * len(items)
+            messages = await bot.send_media_group(chat_id=chat_id, media=_build(False))
+
+        for (kind, _, _), digest, file_id, message in zip(items, digests, cached, messages):
+            metrics.inc("media.hit" if file_id else "media.miss")
+            new_id = _file_id(message, kind)
+            if new_id and new_id != file_id:
+                await self._remember(kind, digest, new_id)
+        return messages
+
+
+media = MediaRegistry()
@@ -0,0 +1,194 @@
+from __future__ import annotations
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Any, Dict, Hashable, Iterator, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+from utils.metrics import metrics
+
+
+class Priority(IntEnum):
+    DELIVERY = 0   # готовое видео и всё, что идёт вместе с ним
+    REPLY = 1      # ответы на действия пользователя
+    PROGRESS = 2   # правки прогресс-баров
+    BROADCAST = 3  # рассылки
+
+
+_priority: ContextVar[Optional[Priority]] = ContextVar("outbound_priority", default=None)
+
+
+@contextmanager
+def outbound_priority(priority: Priority) -> Iterator[None]:
+    """Класс для всех отправок бота внутри блока (и в задачах, созданных внутри него)."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class PriorityTokenBucket:
+    """
+    Token bucket, который при нехватке токенов выдаёт их сначала более приоритетным
+    ожидающим (меньшее значение Priority), внутри одного класса — по порядку прихода.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._pump: Optional[asyncio.Task] = None
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return not self._waiters and self.tokens >= self.burst and self.blocked_until <= self.updated
+
+    def block(self, seconds: float) -> None:
+        """Telegram прислал retry_after — не выдаём токены до его истечения."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    async def acquire(self, priority: Priority) -> None:
+        now = time.monotonic()
+        self._refill(now)
+        if not self._waiters and self.tokens >= 1 and now >= self.blocked_until:
+            self.tokens -= 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (int(priority), next(self._seq), fut))
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run())
+        try:
+            await fut
+        except asyncio.CancelledError:
+            fut.cancel()  # запись в куче пропустится насосом
+            raise
+
+    async def _run(self) -> None:
+        while self._waiters:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                continue
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():
+                continue
+            self.tokens -= 1
+            fut.set_result(None)
+
+
+# класс по умолчанию, если вызывающий код не задал outbound_priority(...)
+_DEFAULT_PRIORITY: Dict[str, Priority] = {
+    "sendVideo": Priority.DELIVERY,
+    "sendDocument": Priority.DELIVERY,
+    "sendAnimation": Priority.DELIVERY,
+}
+
+
+def _is_limited(api_method: str) -> bool:
+    """Методы, которые Telegram ограничивает по частоте; answerCallbackQuery, getFile и т.п. идут сразу."""
+    return api_method.startswith(("send", "edit")) or api_method in ("copyMessage", "forwardMessage")
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """
+    Единая точка для всех исходящих сообщений бота (middleware сессии aiogram).
+
+    - глобальный лимит ~30 сообщений/с и ~1 сообщение/с на чат (token bucket'ы);
+    - при нехватке токенов первыми идут доставка видео, затем ответы, прогресс и рассылки;
+      класс берётся из outbound_priority(...) или по умолчанию из метода;
+    - на TelegramRetryAfter бакет чата (или глобальный) замораживается на retry_after
+      и запрос повторяется, не более max_retries раз.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        max_retries: int = 3,
+        max_chats: int = 10000,
+    ):
+        self.global_bucket = PriorityTokenBucket(rate=global_rate, burst=global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._chats: Dict[str, PriorityTokenBucket] = {}
+        metrics.gauge("outbound.waiting", lambda: self.global_bucket.waiting + sum(b.waiting for b in self._chats.values()))
+        metrics.gauge("outbound.chats", lambda: len(self._chats))
+
+    def _chat_bucket(self, chat_id: Hashable) -> PriorityTokenBucket:
+        # chat_id приходит и числом (хэндлеры), и строкой (внутренние эндпоинты) — бакет один
+        key = str(chat_id)
+        bucket = self._chats.get(key)
+        if bucket is None:
+            if len(self._chats) >= self.max_chats:
+                self._chats = {cid: b for cid, b in self._chats.items() if not b.idle()}
+            bucket = self._chats[key] = PriorityTokenBucket(rate=self.chat_rate, burst=self.chat_burst)
+        return bucket
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        api_method = method.__api_method__
+        if not _is_limited(api_method):
+            return await make_request(bot, method)
+
+        chat_id: Any = getattr(method, "chat_id", None)
+        if chat_id is not None:
+            chat_id = str(chat_id)
+        # DELIVERY == 0, поэтому сравнение с None, а не `or`
+        priority = _priority.get()
+        if priority is None:
+            priority = _DEFAULT_PRIORITY.get(api_method, Priority.REPLY)
+        label = priority.name.lower()
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            if chat_id is not None:
+                await self._chat_bucket(chat_id).acquire(priority)
+            await self.global_bucket.acquire(priority)
+            metrics.observe(f"outbound.wait.{label}", time.monotonic() - started)
+            try:
+                response = await make_request(bot, method)
+                metrics.inc(f"outbound.sent.{label}")
+                return response
+            except TelegramRetryAfter as e:
+                metrics.inc("outbound.retry_after")
+                bucket = self._chat_bucket(chat_id) if chat_id is not None else self.global_bucket
+                bucket.block(e.retry_after)
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                logging.warning("%s to %s hit flood control, retry in %ss", api_method, chat_id, e.retry_after)
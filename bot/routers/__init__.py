@@ -11,17 +11,18 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from bot import fsm
 from bot.api import BackendAPI
+from bot.media import media
 from config import ENV, Settings
 from services.redis import RedisClient
-from services.storage import YandexS3Storage
-from utils.progress import PROGRESS, show_progress
+from services.storage import get_storage
+from utils.progress import progress, start_progress
 from aiogram.enums import ParseMode
 
 
 router = Router()
 env = ENV()
 backend = BackendAPI(env.bot_api_token)
-storage = YandexS3Storage()
+storage = get_storage()
 redis = RedisClient()
 settings = Settings()
 
@@ -83,63 +84,39 @@ def sent_prompt_kb(task_id: str) -> types.InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
     kb.button(text="🔁 Повторить генерацию",
               callback_data=f"repeat_generation:{task_id}")
+    kb.button(text="🎲 Другой вариант",
+              callback_data=f"another_take:{task_id}")
     kb.button(text="🆕 Новый запрос", callback_data="new_generation")
     kb.button(text="🏠 Главное меню", callback_data="start_back")
-    kb.adjust(1, 1, 1)
+    kb.adjust(1, 1, 1, 1)
     return kb.as_markup()
 
 
-async def _stop_task(task: asyncio.Task | None):
-    if task:
-        task.cancel()
-        with suppress(asyncio.CancelledError):
-            await task
-
-
 # --- Команда /start и возвращение в начало ---
 
 @router.message(Command("start"))
 async def command_start(message: types.Message, state: FSMContext):
-
-    # Проверяем наличие пользователя
+    nickname = (
+        message.from_user.username
+        or message.from_user.first_name
+        or f"user_{message.from_user.id}"
+    )
+    # Один запрос: регистрирует при необходимости и отдаёт баланс и роль
     try:
-        exists = await backend.check_user_exist(message.from_user.id)
+        profile = await backend.bootstrap(message.from_user.id, nickname=nickname)
     except Exception:
         await message.answer("Техническая ошибка соединения. Попробуй ещё раз позже.")
         return
 
-    # Если нет — регаем
-    if not exists:
+    coins = profile["coins"]
+    if profile["created"]:
         # Баннер
-        await message.answer_photo(
-            photo=types.URLInputFile(
-                "https://storage.yandexcloud.net/veobot/photo_2025-08-12_00-07-56.jpg"),
+        await media.send(
+            message.bot, "photo", message.chat.id,
+            "https://storage.yandexcloud.net/veobot/photo_2025-08-12_00-07-56.jpg",
+            upload=True,
             caption="Привет! Я генерирую для тебя лучшее видео по твоему запросу.\n\n"
         )
-
-        await message.answer("Ты у нас впервые. Регистрирую…")
-        nickname = (
-            message.from_user.username
-            or message.from_user.first_name
-            or f"user_{message.from_user.id}"
-        )
-        try:
-            res = await backend.register_user(message.from_user.id, nickname=nickname)
-        except Exception:
-            await message.answer("Техническая ошибка при регистрации. Напиши @softp04")
-            return
-
-        if not res.get("created", False) and res.get("reason") != "exists":
-            await message.answer("Внутренняя ошибка регистрации. Напиши @softp04")
-            return
-
-    # Общая ветка после ensure user: получаем баланс и даём меню
-    try:
-        coins = await backend.get_coins(message.from_user.id)
-    except Exception:
-        coins = 0  # если не достали баланс — не роняем UX
-
-    if not exists:
         text = (
             "Регистрация прошла успешно! Теперь давай сгенерируем видео!\n\n"
             f"У тебя {coins} генераций.\n\nШаг 1/3. Выбери способ создания видео:"
@@ -152,7 +129,7 @@ async def command_start(message: types.Message, state: FSMContext):
 
     sent_message: Optional[types.Message] = await message.answer(
         text,
-        reply_markup=start_keyboard(message.from_user.id)
+        reply_markup=start_keyboard(message.from_user.id, role=profile["role"])
     )
 
     # Сохраняем id отправленного сообщения
@@ -164,10 +141,11 @@ async def command_start(message: types.Message, state: FSMContext):
 async def back_to_start(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
     user_id = callback.from_user.id
-    coins = await backend.get_coins(user_id)
+    # баланс и роль — из кэша клиента; bootstrap нужен только в /start
+    coins, user = await asyncio.gather(backend.get_coins(user_id), backend.get_user(user_id))
     sent = await callback.message.answer(
         f"У тебя {coins} генераций.\n\nШаг 1/3. Выбери способ создания видео:",
-        reply_markup=start_keyboard(callback.from_user.id)
+        reply_markup=start_keyboard(callback.from_user.id, role=user.get("role") or "user")
     )
     await state.update_data(start_message_id=sent.message_id)
     await callback.answer()
@@ -243,9 +221,7 @@ async def handle_text_description(message: types.Message, state: FSMContext):
 
     # запускаем прогресс‑индикатор
     progress_msg = await message.answer("⏳ Собираю промпт…")
-    progress_task = asyncio.create_task(
-        show_progress(progress_msg, stage="prompt"))
-
+    progress_key = await start_progress(progress_msg, stage="prompt")
     try:
         ru_text, en_text = await backend.suggest_prompt(
             chat_id=str(message.from_user.id),
@@ -259,7 +235,7 @@ async def handle_text_description(message: types.Message, state: FSMContext):
         await message.answer("Не удалось получить промпт. Попробуйте ещё раз.")
         return
     finally:
-        await _stop_task(progress_task)
+        progress.cancel(progress_key)
 
     await state.update_data(
         prompt_brief=brief,
@@ -300,15 +276,12 @@ async def handle_photo(message: types.Message, state: FSMContext):
     file_bytes = await message.bot.download_file(file.file_path)
 
     # загружаем на S3
-    image_url = storage.save(file_bytes.getvalue(
-    ), extension=".jpg", prefix="prompt_inputs/")
+    image_url = await storage.save(file_bytes.getvalue(), extension=".jpg", prefix="prompt_inputs/")
     await state.update_data(image_url=image_url, prompt_attempt=1, prompt_clarifications=[])
 
     # запускаем прогресс‑индикатор
     progress_msg = await message.answer("⏳ Анализирую фото и собираю промпт…")
-    progress_task = asyncio.create_task(
-        show_progress(progress_msg, stage="prompt"))
-
+    progress_key = await start_progress(progress_msg, stage="prompt")
     try:
         # генерируем промпт, передав image_url в backend
         ru_text, en_text = await backend.suggest_prompt(
@@ -324,7 +297,7 @@ async def handle_photo(message: types.Message, state: FSMContext):
         await message.answer("Не удалось получить промпт. Попробуйте ещё раз.")
         return
     finally:
-        await _stop_task(progress_task)
+        progress.cancel(progress_key)
 
     await state.update_data(prompt_last=en_text)
     await progress_msg.edit_text(f"`{ru_text}`", parse_mode="Markdown", reply_markup=prompt_options_kb())
@@ -355,9 +328,7 @@ async def prompt_other(callback: types.CallbackQuery, state: FSMContext):
     progress_msg = await callback.message.answer("⏳ Получаю новый вариант…")
 
     # запускаем прогресс‑бар параллельно
-    progress_task = asyncio.create_task(
-        show_progress(progress_msg, stage="prompt")
-    )
+    progress_key = await start_progress(progress_msg, stage="prompt")
 
     try:
         ru_text, en_text = await backend.suggest_prompt(
@@ -372,7 +343,7 @@ async def prompt_other(callback: types.CallbackQuery, state: FSMContext):
         await progress_msg.edit_text("❌ Не удалось получить новый вариант. Попробуйте ещё раз.")
         return
     finally:
-        await _stop_task(progress_task)
+        progress.cancel(progress_key)
 
     # сохраняем обновлённые данные
     await state.update_data(prompt_last=en_text, prompt_attempt=attempt)
@@ -408,9 +379,7 @@ async def prompt_receive_edit(message: types.Message, state: FSMContext):
 
     # отправляем сообщение о загрузке и запускаем прогресс‑бар
     progress_msg = await message.answer("⏳ Собираю новый вариант с учётом правок…")
-    progress_task = asyncio.create_task(
-        show_progress(progress_msg, stage="prompt")
-    )
+    progress_key = await start_progress(progress_msg, stage="prompt")
 
     try:
         ru_text, en_text = await backend.suggest_prompt(
@@ -425,7 +394,7 @@ async def prompt_receive_edit(message: types.Message, state: FSMContext):
         await progress_msg.edit_text("❌ Не удалось получить новый вариант. Попробуйте ещё раз.")
         return
     finally:
-        await _stop_task(progress_task)
+        progress.cancel(progress_key)
 
     # обновляем данные в FSM
     await state.update_data(prompt_clarifications=clar, prompt_last=en_text, prompt_attempt=attempt)
@@ -491,38 +460,34 @@ async def aspect_ratio_chosen(callback: types.CallbackQuery, state: FSMContext):
             )
 
         task_id = task["task_id"]
-        # здесь формируем словарь с нужным контекстом для повторной генерации
-        raw_ctx = {
-            "prompt": prompt_text,
-            "mode": mode,
-            "aspect_ratio": aspect_ratio,
-            "image_url": image_url if mode == "photo" else None,
-        }
-
-        # coхраняем контекст в БД – ошибки ловим по месту
-        with suppress(Exception):
-            await backend.save_task(task_id, str(callback.from_user.id), raw_ctx, is_video=(mode == "photo"), rating=0)
-
-        await callback.message.answer(
-            f"🚀 Приступил к генерации видео.\nОстаток: {coins -1}.\n"
-            "По готовности пришлю уведомление.\n"
-            "Сделать ещё?",
-            reply_markup=sent_prompt_kb(task_id)
-        )
-        # запускаем прогресс‑бар для генерации видео
-        progress_msg = await callback.message.answer("⏳ Генерирую видео…")
-        progress_task = asyncio.create_task(
-            show_progress(progress_msg, stage="video"))
-        PROGRESS[task_id] = {
-            "task": progress_task,
-            "chat_id": callback.message.chat.id,
-            "message_id": progress_msg.message_id,
-        }
+        # контекст для повторной генерации бэкенд сохраняет вместе со списанием
+        await _announce_generation(callback.message, task, task_id, coins, mode, aspect_ratio)
     except Exception as e:
         logging.exception("Ошибка запуска генерации: %s", e)
         await callback.message.answer("❌ Не удалось запустить генерацию.")
         return
 
+async def _announce_generation(message: types.Message, task: dict, kb_task_id: str, coins: int, mode, aspect_ratio) -> None:
+    """Сообщение о запуске и прогресс‑бар; видео из кэша бэкенд присылает сразу, без прогресса."""
+    if task.get("cached"):
+        await message.answer(
+            f"✅ Такое видео уже есть — сейчас пришлю.\nОстаток: {coins -1}.\n"
+            "Нужен другой вариант — нажми «🎲 Другой вариант».",
+            reply_markup=sent_prompt_kb(kb_task_id)
+        )
+        return
+    await message.answer(
+        f"🚀 Приступил к генерации видео.\nОстаток: {coins -1}.\n"
+        "По готовности пришлю уведомление.\n"
+        "Сделать ещё?",
+        reply_markup=sent_prompt_kb(kb_task_id)
+    )
+    # заводим прогресс и регистрируем его для последующего finish
+    progress_msg = await message.answer("⏳ Генерирую видео…")
+    estimate = await backend.get_estimate(mode, aspect_ratio)
+    await start_progress(progress_msg, stage="video", key=task["task_id"], estimate=estimate)
+
+
 # --- Повтор и новый запрос ---
 
 # @router.callback_query(F.data == "repeat_generation")
@@ -573,11 +538,12 @@ async def aspect_ratio_chosen(callback: types.CallbackQuery, state: FSMContext):
 #         await _stop_task(progress_task)
 
 
-@router.callback_query(F.data.startswith("repeat_generation:"))
+@router.callback_query(F.data.startswith(("repeat_generation:", "another_take:")))
 async def on_repeat_generation_by_task(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
-    _, task_id = callback.data.split(":", 1)
-    progress_task: asyncio.Task | None = None
+    action, task_id = callback.data.split(":", 1)
+    # «другой вариант» — новая генерация в KIE, даже если такое видео уже есть
+    fresh = action == "another_take"
 
     coins = await backend.get_coins(callback.from_user.id)
     if coins == 0:
@@ -605,41 +571,18 @@ async def on_repeat_generation_by_task(callback: types.CallbackQuery, state: FSM
                 prompt=prompt,
                 image_url=image_url,
                 aspect_ratio=aspect_ratio,
+                fresh=fresh,
             )
         else:
             new_task = await backend.generate_text(
                 chat_id=str(callback.from_user.id),
                 prompt=prompt,
                 aspect_ratio=aspect_ratio,
+                fresh=fresh,
             )
 
-        new_task_id = new_task["task_id"]
-
-        # сохраняем новый контекст и показываем клавиатуру
-        with suppress(Exception):
-            await backend.save_task(
-                new_task_id,
-                str(callback.from_user.id),
-                raw,
-                is_video=(mode == "photo"),
-                rating=0,
-            )
-        await callback.message.answer(
-            f"🚀 Приступил к генерации видео.\nОстаток: {coins -1}.\n"
-            "По готовности пришлю уведомление.\n"
-            "Сделать ещё?",
-            reply_markup=sent_prompt_kb(task_id)
-        )
         await callback.answer()
-        # заводим прогресс и регистрируем его для последующего finish
-        progress_msg = await callback.message.answer("⏳ Генерирую видео…")
-        progress_task = asyncio.create_task(
-            show_progress(progress_msg, stage="video"))
-        PROGRESS[new_task_id] = {
-            "task": progress_task,
-            "chat_id": callback.message.chat.id,
-            "message_id": progress_msg.message_id,
-        }
+        await _announce_generation(callback.message, new_task, task_id, coins, mode, aspect_ratio)
 
     except Exception as e:
         logging.exception("Ошибка при повторной генерации: %s", e)
@@ -681,8 +624,7 @@ async def on_rate(callback: types.CallbackQuery, state: FSMContext):
 @router.callback_query(F.data == "hello")
 async def testing(callback: types.CallbackQuery):
     progress_msg = await callback.message.answer("⏳ Генерирую видео…")
-    progress_task = asyncio.create_task(
-        show_progress(progress_msg, stage="video"))
+    await start_progress(progress_msg, stage="video")
     print(callback.bot, callback.from_user.id, progress_msg.message_id)
 
 
@@ -255,6 +255,8 @@ async def successful_payment(message: types.Message):
     try:
         new_coins = await backend.plus_coins(message.from_user.id, count=coins)
     except Exception:
+        # результат начисления неизвестен — кэшированный баланс больше не верим
+        await backend.invalidate_user(message.from_user.id)
         await message.answer("Платёж прошёл, но пополнить баланс не удалось. Напишите @softp04, укажи этот код: PAY-APPLY-ERR")
         return
 
@@ -0,0 +1,194 @@
+from __future__ import annotations
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import suppress
+from typing import Deque, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from utils.metrics import metrics
+
+
+class UpdateDeduplicator:
+    """
+    Отбрасывает повторные доставки апдейтов Telegram по update_id.
+
+    backend="redis" — общий для всех воркеров SET NX с TTL (одна команда на апдейт);
+    backend="memory" — кольцо последних `window` id в одном процессе;
+    backend="off" — без дедупликации.
+    При недоступном Redis апдейт пропускается дальше: лучше обработать дубль, чем потерять апдейт.
+    """
+    PREFIX = "tg:update:"
+
+    def __init__(self, backend: str = "redis", ttl: int = 3600, window: int = 100000, redis=None):
+        if backend not in ("redis", "memory", "off"):
+            raise ValueError(f"Unknown dedup backend: {backend!r}")
+        self.backend = backend
+        self.ttl = ttl
+        self._ring: Deque[int] = deque(maxlen=window)
+        self._seen: set[int] = set()
+        self._redis = redis
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            from services.redis import RedisClient
+            self._redis = RedisClient()
+        return self._redis
+
+    async def is_duplicate(self, update_id: int) -> bool:
+        """Отмечает update_id как увиденный; True — он уже был."""
+        if self.backend == "off":
+            return False
+        if self.backend == "memory":
+            duplicate = update_id in self._seen
+            if not duplicate:
+                if len(self._ring) == self._ring.maxlen:
+                    self._seen.discard(self._ring[0])
+                self._ring.append(update_id)
+                self._seen.add(update_id)
+        else:
+            try:
+                duplicate = not await self.redis.set_once(f"{self.PREFIX}{update_id}", ttl=self.ttl)
+            except Exception as e:
+                logging.warning("Update dedup unavailable, passing update %s through: %s", update_id, e)
+                return False
+        if duplicate:
+            metrics.inc("updates.dedup.dropped")
+        return duplicate
+
+    async def forget(self, update_id: int) -> None:
+        """Снимает отметку, чтобы повторная доставка после ошибки обработалась заново."""
+        if self.backend == "memory":
+            self._seen.discard(update_id)
+        elif self.backend == "redis":
+            with suppress(Exception):
+                await self.redis.delete(f"{self.PREFIX}{update_id}")
+
+
+def parse_update(body: bytes, bot: Optional[Bot] = None) -> Update:
+    """
+    Тело вебхука сразу в Update: pydantic-core разбирает JSON-байты сам,
+    без промежуточного dict (json.loads) и второго прохода Update(**data).
+    Бот кладётся в контекст валидации, как это делает и сам aiogram.
+    """
+    return Update.model_validate_json(body, context={"bot": bot})
+
+
+class UpdateQueue:
+    """
+    Очередь входящих апдейтов Telegram.
+
+    Вебхук только кладёт апдейт в очередь и сразу отвечает 200, а пул из `workers`
+    корутин прогоняет апдейты через Dispatcher. Апдейты одного чата обрабатываются
+    строго по очереди, разные чаты — параллельно, но не больше `workers` одновременно.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, workers: int = 8, max_pending: int = 10000):
+        self.dp = dp
+        self.bot = bot
+        self.workers = workers
+        self.max_pending = max_pending
+        # chat_key -> апдейты этого чата в порядке поступления; ключ живёт, пока чат в работе
+        self._pending: Dict[int, Deque[tuple[Update, float]]] = {}
+        # чаты, у которых есть что обработать и которые сейчас никем не заняты
+        self._ready: asyncio.Queue[int] = asyncio.Queue()
+        self._size = 0
+        self._busy = 0
+        self._tasks: list[asyncio.Task] = []
+        metrics.gauge("updates.queue.depth", lambda: self._size)
+        metrics.gauge("updates.queue.chats", lambda: len(self._pending))
+
+    @property
+    def depth(self) -> int:
+        return self._size
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    @staticmethod
+    def chat_key(update: Update) -> int:
+        """Ключ упорядочивания: чат события, иначе пользователь, иначе сам апдейт."""
+        try:
+            event = update.event
+        except Exception:
+            return update.update_id
+        chat = getattr(event, "chat", None)
+        if chat is not None:
+            return chat.id
+        message = getattr(event, "message", None)
+        if message is not None and getattr(message, "chat", None) is not None:
+            return message.chat.id
+        user = getattr(event, "from_user", None)
+        if user is not None:
+            return user.id
+        return update.update_id
+
+    def put(self, update: Update) -> bool:
+        """
+        Кладёт апдейт в очередь. False — воркеры не запущены или очередь переполнена;
+        переполненную очередь обходить нельзя: ранние апдейты чата ещё в ней.
+        """
+        if not self._tasks or self._size >= self.max_pending:
+            metrics.inc("updates.queue.overflow")
+            return False
+        key = self.chat_key(update)
+        item = (update, time.monotonic())
+        chat_queue = self._pending.get(key)
+        if chat_queue is None:
+            self._pending[key] = deque([item])
+            self._ready.put_nowait(key)
+        else:
+            # чат уже в очереди или в работе — воркер заберёт апдейт следующим
+            chat_queue.append(item)
+        self._size += 1
+        metrics.inc("updates.queue.enqueued")
+        return True
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker(), name=f"updates-worker-{i}") for i in range(self.workers)]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Даёт дообработать очередь (не дольше timeout) и гасит воркеров."""
+        deadline = time.monotonic() + timeout
+        while (self._size or self._busy) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            with suppress(asyncio.CancelledError):
+                await task
+        self._tasks = []
+        if self._size:
+            logging.warning("UpdateQueue stopped with %s unprocessed updates", self._size)
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._ready.get()
+            chat_queue = self._pending[key]
+            update, enqueued_at = chat_queue.popleft()
+            self._size -= 1
+            metrics.observe("updates.queue.lag", time.monotonic() - enqueued_at)
+            self._busy += 1
+            try:
+                with metrics.timer("updates.handle"):
+                    await self.dp.feed_update(self.bot, update)
+                metrics.inc("updates.queue.processed")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                metrics.inc("updates.queue.failed")
+                logging.exception("Failed to process update %s", update.update_id)
+            finally:
+                self._busy -= 1
+                if chat_queue:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._pending[key]
+
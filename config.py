@@ -45,6 +45,77 @@ class ENV(BaseSettings):
     ADMIN_SITE: str
     bot_username: str
 
+    # Транспорт BackendAPI: "http" — по сети, "asgi" — в процессе, напрямую в FastAPI-приложение
+    backend_transport: str = "http"
+    # Кэш баланса/профиля в BackendAPI: размер, TTL (сек) и общий уровень в Redis
+    backend_cache_size: int = 10000
+    backend_cache_ttl: float = 15.0
+    backend_cache_redis: bool = False
+
+    # Вебхук: "inline" — апдейт обрабатывается внутри HTTP-запроса, "queue" — через очередь и пул воркеров
+    # (при переполненной очереди вебхук отвечает 503, и Telegram доставляет апдейт повторно)
+    webhook_mode: str = "inline"
+    webhook_workers: int = 16
+    webhook_queue_size: int = 10000
+    # Отсев повторных доставок по update_id: "redis" (общий для воркеров), "memory" или "off"
+    webhook_dedup: str = "redis"
+    webhook_dedup_ttl: int = 3600
+
+    # FSM aiogram: "memory" — в процессе (только один воркер), "redis" — общее для всех воркеров
+    fsm_storage: str = "memory"
+    fsm_ttl: int = 86400
+
+    # Лимиты исходящих сообщений Telegram (сообщений в секунду): на весь бот и на один чат
+    tg_global_rate: float = 30.0
+    tg_chat_rate: float = 1.0
+    tg_chat_burst: int = 3
+
+    # Прогресс-бары генерации: через сколько секунд недоделанный бар считается брошенным
+    # и удаляется sweeper'ом, и как часто sweeper проходит
+    progress_max_age: int = 7200
+    progress_sweep_interval: int = 300
+
+    # Опрос статусов задач KIE: период для свежих задач (0 — выключен) и число параллельных запросов
+    kie_poll_interval: float = 10.0
+    kie_poll_concurrency: int = 8
+
+    # Допуск к KIE: задач в работе всего (0 — допуск выключен) и на пользователя (0 — без ограничения),
+    # сколько секунд запрос ждёт общего слота и вес партнёров в честной очереди.
+    # Слоты общие через Redis, а очередь и позиции в ней — у каждого процесса API свои
+    kie_max_inflight: int = 0
+    kie_max_inflight_per_user: int = 2
+    admission_max_wait: float = 90.0
+    admission_partner_weight: float = 2.0
+
+    # Кэш готовых видео для одинаковых запросов: время жизни (0 — выключен) и число записей
+    result_cache_ttl: int = 0
+    result_cache_max: int = 5000
+
+    # Сверка задач без колбэка: период (0 — выключена), с какого возраста задача считается
+    # зависшей и через сколько секунд без результата монета возвращается
+    reconcile_interval: float = 300.0
+    reconcile_grace: int = 900
+    reconcile_timeout: int = 10800
+
+    # HTTP-клиент KIE: размер пула соединений, таймауты (секунды) и число повторов
+    kie_pool_size: int = 100
+    kie_connect_timeout: float = 5.0
+    kie_read_timeout: float = 30.0
+    kie_retries: int = 2
+
+    # Потоковая загрузка готовых видео в S3: одновременных загрузок на процесс,
+    # размер части multipart (МБ, не меньше 5 — требование S3) и частей в полёте на одну загрузку
+    s3_max_transfers: int = 4
+    s3_part_size_mb: int = 8
+    s3_parts_in_flight: int = 2
+    # потоков и соединений boto3 на процесс
+    s3_pool_size: int = 16
+    # имена объектов из sha256 содержимого (видео — из taskId) и проверка HEAD перед загрузкой
+    yc_s3_content_addressed: bool = False
+
+    # Колбэк KIE: "inline" — обработка в запросе, "celery" — ответ после постановки в очередь Celery
+    callback_mode: str = "inline"
+
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
 class Settings():
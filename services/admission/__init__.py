@@ -0,0 +1,215 @@
+from __future__ import annotations
+import asyncio
+import itertools
+import logging
+import time
+import uuid
+from contextlib import suppress
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from services.redis import RedisClient
+from utils.metrics import metrics
+
+
+OnPosition = Callable[[int], Awaitable[None]]
+WeightOf = Callable[[], Awaitable[float]]
+
+
+class AdmissionTimeout(Exception): ...
+
+
+class AdmissionUserLimit(Exception):
+    def __init__(self, limit: int):
+        super().__init__(f"У тебя уже запущено генераций: {limit}. Дождись, пока одна из них закончится")
+        self.limit = limit
+
+
+@dataclass
+class _Ticket:
+    chat_id: str
+    token: str
+    start: float
+    tag: float
+    seq: int
+    future: asyncio.Future = field(repr=False)
+
+
+class AdmissionController:
+    """
+    Допуск запросов на генерацию к KIE.
+
+    Слоты общие для всех воркеров и живут в Redis: не больше `global_limit` задач KIE
+    в работе и не больше `user_limit` на пользователя (задача держит слот до колбэка,
+    падения или сверки). Пользователь на своём лимите получает отказ сразу
+    (AdmissionUserLimit): его слот освободится только с концом генерации, ждать нечего.
+    Запрос, которому не хватило общего слота, встаёт в очередь своего процесса API —
+    очередь и позиции в ней не общие между процессами, общие только слоты.
+    Очередь взвешенная честная (start-time fair queueing): пользователь с весом 2
+    получает вдвое больше слотов, внутри одного пользователя порядок FIFO. Позиция
+    сообщается через on_position; дольше `max_wait` запрос не ждёт (AdmissionTimeout).
+    """
+
+    def __init__(
+        self,
+        global_limit: int,
+        user_limit: int,
+        max_wait: float = 90.0,
+        horizon: int = 10800,
+        lease: int = 120,
+        poll: float = 1.0,
+        report_every: float = 10.0,
+        redis: Optional[RedisClient] = None,
+    ):
+        self.global_limit = global_limit
+        self.user_limit = user_limit
+        self.max_wait = max_wait
+        self.horizon = horizon
+        self.lease = lease
+        self.poll = poll
+        self.report_every = report_every
+        self._redis = redis
+        self._waiters: List[_Ticket] = []
+        self._vtime = 0.0
+        self._finish: Dict[str, float] = {}
+        self._seq = itertools.count()
+        self._wake = asyncio.Event()
+        self._pump: Optional[asyncio.Task] = None
+        metrics.gauge("admission.queued", lambda: len(self._waiters))
+
+    @property
+    def redis(self) -> RedisClient:
+        if self._redis is None:
+            self._redis = RedisClient()
+        return self._redis
+
+    @property
+    def enabled(self) -> bool:
+        return self.global_limit > 0
+
+    def position(self, chat_id: str) -> Optional[int]:
+        """Место первого запроса пользователя в очереди (с 1) или None."""
+        for index, ticket in enumerate(self._ordered(), start=1):
+            if ticket.chat_id == chat_id:
+                return index
+        return None
+
+    def depth(self) -> int:
+        return len(self._waiters)
+
+    def _ordered(self) -> List[_Ticket]:
+        return sorted(self._waiters, key=lambda t: (t.tag, t.seq))
+
+    async def _try(self, chat_id: str, token: str) -> int:
+        return await self.redis.admission_try(
+            token, chat_id, self.global_limit, self.user_limit, self.horizon, self.lease,
+        )
+
+    async def acquire(
+        self,
+        chat_id: str,
+        weight_of: Optional[WeightOf] = None,
+        on_position: Optional[OnPosition] = None,
+    ) -> str:
+        """Ждёт слот и возвращает его token; дальше — commit() с taskId KIE или release()."""
+        chat_id = str(chat_id)
+        token = uuid.uuid4().hex
+        if self.user_limit > 0 and await self.redis.admission_user_count(chat_id) >= self.user_limit:
+            metrics.inc("admission.user_limit")
+            raise AdmissionUserLimit(self.user_limit)
+        # без очереди — сразу; иначе вперёд очереди не пускаем
+        if not self._waiters:
+            admitted = await self._try(chat_id, token)
+            if admitted == 1:
+                metrics.inc("admission.direct")
+                return token
+            if admitted < 0:
+                metrics.inc("admission.user_limit")
+                raise AdmissionUserLimit(self.user_limit)
+
+        weight = max(0.1, await weight_of()) if weight_of else 1.0
+        start = max(self._vtime, self._finish.get(chat_id, 0.0))
+        ticket = _Ticket(
+            chat_id=chat_id,
+            token=token,
+            start=start,
+            tag=start + 1.0 / weight,
+            seq=next(self._seq),
+            future=asyncio.get_running_loop().create_future(),
+        )
+        self._finish[chat_id] = ticket.tag
+        self._waiters.append(ticket)
+        metrics.inc("admission.queued_total")
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run(), name="kie-admission")
+        self._wake.set()
+
+        started = time.monotonic()
+        reported = None
+        try:
+            while not ticket.future.done():
+                left = self.max_wait - (time.monotonic() - started)
+                if left <= 0:
+                    break
+                position = self._ordered().index(ticket) + 1 if ticket in self._waiters else None
+                if on_position and position and position != reported:
+                    reported = position
+                    try:
+                        await on_position(position)
+                    except Exception as e:
+                        logging.debug("queue position report failed: %s", e)
+                await asyncio.wait({ticket.future}, timeout=min(left, self.report_every))
+        finally:
+            if not ticket.future.done():
+                ticket.future.cancel()
+            with suppress(ValueError):
+                self._waiters.remove(ticket)
+            metrics.observe("admission.wait", time.monotonic() - started)
+
+        if ticket.future.cancelled():
+            metrics.inc("admission.timeout")
+            raise AdmissionTimeout("Слишком много запросов на генерацию, попробуйте через пару минут")
+        ticket.future.result()
+        return token
+
+    async def commit(self, token: str, chat_id: str, task_id: str) -> None:
+        await self.redis.admission_commit(token, str(chat_id), task_id, self.horizon)
+
+    async def release(self, token: str, chat_id: str) -> None:
+        try:
+            await self.redis.admission_release(token, str(chat_id))
+        finally:
+            self._wake.set()
+
+    async def _run(self) -> None:
+        while self._waiters:
+            try:
+                await self._dispatch()
+            except Exception as e:
+                logging.warning("Admission dispatch failed: %s", e)
+            self._wake.clear()
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wake.wait(), self.poll)
+        # пустая очередь — виртуальное время и отметки пользователей больше не нужны
+        self._finish.clear()
+
+    async def _dispatch(self) -> None:
+        for ticket in self._ordered():
+            if ticket.future.done():
+                continue
+            admitted = await self._try(ticket.chat_id, ticket.token)
+            if admitted == 0:
+                return
+            with suppress(ValueError):
+                self._waiters.remove(ticket)
+            if admitted < 0:
+                # пользователь занял свои слоты, пока запрос стоял в очереди
+                if not ticket.future.done():
+                    ticket.future.set_exception(AdmissionUserLimit(self.user_limit))
+                continue
+            self._vtime = max(self._vtime, ticket.start)
+            if ticket.future.done():
+                # ожидание истекло, пока шёл запрос в Redis
+                await self.redis.admission_release(ticket.token, ticket.chat_id)
+            else:
+                ticket.future.set_result(True)
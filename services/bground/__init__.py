@@ -9,7 +9,7 @@ class CeleryManager:
             "veo3_bot",
             broker=self.env.CELERY_BROKER_URL,
             backend=self.env.CELERY_RESULT_BACKEND,
-            include=["tasks.veo", "tasks.prompt"]
+            include=["services.bground.tasks"]
         )
 
         self.celery_app.conf.update(
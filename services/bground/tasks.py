@@ -1,16 +1,22 @@
 from __future__ import annotations
-from typing import Any, Dict
-import asyncio
+from typing import Any, Dict, Optional
+import logging
+import random
+import time
 from celery import states
 from celery.exceptions import Ignore
+from celery.signals import worker_process_init, worker_process_shutdown, worker_shutdown
 
 from services.bground import CeleryManager
+from services.bground.worker import WorkerContext
 from services.veo import VeoService
 from services.kie import GenerateRequests
-from services.storage import YandexS3Storage
+from services.storage import get_storage
 from services.redis import RedisClient
 from services.notifier import BotNotifier
 from api.crud.user import UserService
+from api.crud.task import TaskCRUD
+from api.database import async_session_maker
 
 celery_app = CeleryManager()
 
@@ -19,41 +25,84 @@ def _make_service() -> VeoService:
     return VeoService(
         users=UserService(),
         gen=GenerateRequests(),
-        storage=YandexS3Storage(),
+        storage=get_storage(),
         redis=RedisClient(),
         notifier=BotNotifier(),
+        tasks=TaskCRUD(),
     )
 
-@celery_app.celery_app.task(bind=True, max_retries=3, name="veo.postprocess_callback")
+_worker: Optional[WorkerContext] = None
+
+
+def _context() -> WorkerContext:
+    """Контекст процесса; для пула solo (нет worker_process_init) создаётся на первой задаче."""
+    global _worker
+    if _worker is None:
+        _worker = WorkerContext(_make_service)
+    return _worker
+
+
+@worker_process_init.connect
+def _init_worker(**_):
+    _context()
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def _shutdown_worker(**_):
+    global _worker
+    if _worker is not None:
+        _worker.close()
+        _worker = None
+
+MAX_RETRIES = 5
+
+
+def callback_job_id(task_id: str) -> str:
+    """Один Celery job на taskId: повторная доставка колбэка его не дублирует."""
+    return f"veo-callback-{task_id}"
+
+
+@celery_app.celery_app.task(bind=True, max_retries=MAX_RETRIES, name="veo.postprocess_callback")
 def postprocess_callback(self, payload: Dict[str, Any]) -> Dict[str, Any]:
     """
     Обрабатывает колбэк от KIE в фоне:
-      - парсит результат,
-      - скачивает видео,
-      - грузит в S3,
+      - возврат монеты, если генерация упала,
+      - скачивает видео и грузит в S3 потоком,
       - шлёт нотификацию боту,
       - чистит Redis по task_id.
+    Уже обработанный taskId пропускается (состояние veo:cb:{taskId}). Ошибки — повтор с растущей паузой,
+    после MAX_RETRIES колбэк уходит в dead-letter (Redis-список dead:veo_callback).
     """
-    svc = _make_service()
+    task_id = ((payload or {}).get("data") or {}).get("taskId")
+    ctx = _context()
+    svc = ctx.svc
 
     async def _run():
         # Можно давать «реальный» прогресс через update_state
-        self.update_state(state=states.STARTED, meta={"step": "parse_payload"})
-        result = await svc.handle_callback(payload)
-
-        # Для наглядности обновим финальное состояние
-        self.update_state(state=states.SUCCESS, meta={
-            "task_id": result.get("task_id"),
-            "status": result.get("status"),
-            "result_url": result.get("result_url"),
-            "source_url": result.get("source_url"),
-            "fallback": result.get("fallback"),
+        self.update_state(state=states.STARTED, meta={"step": "process_callback"})
+        async with async_session_maker() as session:
+            return await svc.process_callback(payload, session)
+
+    async def _dead_letter(error: Exception):
+        await svc.redis.push_dead_letter("veo_callback", {
+            "task_id": task_id,
+            "payload": payload,
+            "error": repr(error),
+            "retries": self.request.retries,
+            "failed_at": int(time.time()),
         })
-        return result
+        # следующая доставка колбэка от KIE сможет поставить задачу заново
+        await svc.redis.callback_forget(task_id)
 
     try:
-        return asyncio.run(_run())
+        return ctx.run(_run())
     except Exception as e:
+        if self.request.retries < MAX_RETRIES:
+            countdown = min(600, 15 * 2 ** self.request.retries) + random.uniform(0, 5)
+            raise self.retry(exc=e, countdown=countdown)
+        logging.exception("Callback %s moved to dead-letter after %s retries", task_id, self.request.retries)
+        ctx.run(_dead_letter(e))
         # Обновим мету и пометим как FAIL, без бесконечных ретраев
         self.update_state(state=states.FAILURE, meta={"error": str(e)})
         raise  # пусть воркер логирует трейс
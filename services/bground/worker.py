@@ -0,0 +1,41 @@
+from __future__ import annotations
+import asyncio
+import logging
+from typing import Awaitable, Callable, TypeVar
+
+from api.database import engine
+from services.veo import VeoService
+
+T = TypeVar("T")
+
+
+class WorkerContext:
+    """
+    Event loop и зависимости процесса воркера Celery (prefork или solo).
+
+    Создаются один раз при старте процесса: задачи выполняются в этом loop через run(),
+    поэтому пулы соединений KIE, Redis и БД переиспользуются между задачами.
+    Закрывается на остановке процесса.
+    """
+
+    def __init__(self, make_service: Callable[[], VeoService]):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.svc = make_service()
+
+    def run(self, coro: Awaitable[T]) -> T:
+        return self.loop.run_until_complete(coro)
+
+    def close(self) -> None:
+        try:
+            self.run(self._aclose())
+        except Exception as e:
+            logging.warning("Worker context close failed: %s", e)
+        finally:
+            self.svc.storage.close()
+            self.loop.close()
+
+    async def _aclose(self) -> None:
+        await self.svc.gen.close()
+        await self.svc.redis.redis.aclose()
+        await engine.dispose()
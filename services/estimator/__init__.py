@@ -0,0 +1,73 @@
+from __future__ import annotations
+import json
+import logging
+from datetime import datetime
+from typing import Dict
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api.crud.task import TaskCRUD
+from services.redis import RedisClient
+from utils.estimates import estimate_key
+
+
+class DurationEstimator:
+    """
+    Оценка длительности генерации (отправка в KIE → колбэк) по истории задач.
+
+    Берёт последние `window` завершённых задач, группирует по режиму (text/photo)
+    и формату и считает p50/p90. Группы меньше `min_samples` не публикуются —
+    для них pick_estimate возьмёт оценку по режиму или общую.
+    Результат кэшируется в Redis на `ttl` секунд, общий для всех воркеров.
+    """
+    KEY = "veo:estimates"
+
+    def __init__(self, tasks: TaskCRUD, redis: RedisClient, ttl: int = 600, window: int = 2000, min_samples: int = 20):
+        self.tasks = tasks
+        self.redis = redis
+        self.ttl = ttl
+        self.window = window
+        self.min_samples = min_samples
+
+    async def estimates(self, session: AsyncSession) -> Dict[str, dict]:
+        cached = await self.redis.get_json(self.KEY)
+        if cached is not None:
+            return cached
+        result = self.compute(await self.tasks.recent_durations(session, limit=self.window))
+        await self.redis.set_json(self.KEY, result, ttl=self.ttl)
+        return result
+
+    def compute(self, rows) -> Dict[str, dict]:
+        groups: Dict[str, list[float]] = {}
+        for raw, created_at, completed_at in rows:
+            try:
+                seconds = (_parse(completed_at) - _parse(created_at)).total_seconds()
+                ctx = json.loads(raw) if raw else {}
+            except Exception:
+                continue
+            if seconds <= 0:
+                continue
+            mode = ctx.get("mode") or "text"
+            for key in (estimate_key(mode, ctx.get("aspect_ratio")), f"{mode}:*", "*"):
+                groups.setdefault(key, []).append(seconds)
+
+        result = {}
+        for key, durations in groups.items():
+            if len(durations) < self.min_samples:
+                continue
+            durations.sort()
+            result[key] = {
+                "p50": round(_percentile(durations, 0.5), 1),
+                "p90": round(_percentile(durations, 0.9), 1),
+                "samples": len(durations),
+            }
+        logging.debug("duration estimates: %s", result)
+        return result
+
+
+def _parse(value: str) -> datetime:
+    return datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+
+
+def _percentile(ordered: list[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
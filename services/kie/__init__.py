@@ -1,31 +1,114 @@
+from __future__ import annotations
+import asyncio
+import logging
+import random
+import time
+
 import aiohttp
+
 from config import ENV
+from utils.metrics import metrics
 
-import aiohttp
+
+class KieTransientError(RuntimeError):
+    """Ответ KIE, который имеет смысл повторить (429/5xx)."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
 
 
 class GenerateRequests:
-    def __init__(self):
+    """
+    Клиент KIE. Один экземпляр на приложение (kie_client): общий пул соединений
+    с keep-alive и кэшем DNS, явные таймауты на соединение и чтение.
+
+    Повторы с экспоненциальной паузой и джиттером: GET — на любые временные ошибки
+    (сеть, таймаут, 429/5xx); POST создаёт задачу и списывает деньги в KIE, поэтому
+    повторяется, только если соединение не установилось или KIE явно ответил 429.
+    """
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    MODEL = "veo3_fast"
+
+    def __init__(self, session: aiohttp.ClientSession | None = None):
         self.env = ENV()
         self.token = self.env.KIE_TOKEN
         self.callback_url = f"{self.env.BASE_URL}/{self.env.CALLBACK_PATH}"
+        self.retries = self.env.kie_retries
+        # внешняя сессия — у владельца; своя создаётся лениво внутри event loop
+        self.session = session
+        self._own_session = session is None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.env.kie_pool_size,
+                    ttl_dns_cache=300,
+                    keepalive_timeout=60,
+                ),
+                timeout=aiohttp.ClientTimeout(
+                    connect=self.env.kie_connect_timeout,
+                    sock_read=self.env.kie_read_timeout,
+                ),
+            )
+            self._own_session = True
+        return self.session
+
+    async def close(self) -> None:
+        if self._own_session and self.session is not None and not self.session.closed:
+            await self.session.close()
+        if self._own_session:
+            self.session = None
 
     async def _request(self, method: str, url: str, **kwargs) -> dict:
         headers = kwargs.pop("headers", {})
         headers.update({"Authorization": f"Bearer {self.token}"})
-        async with aiohttp.ClientSession() as session:
-            async with session.request(method, url, headers=headers, **kwargs) as r:
-                data = await r.json()
-                # KIE всегда возвращает HTTP 200, но внутри есть поле code
-                if not isinstance(data, dict) or data.get("code") != 200:
-                    raise RuntimeError(f"KIE error: {data}")
+        endpoint = url.rsplit("/", 1)[-1]
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                data = await self._send(self._get_session(), method, url, headers=headers, **kwargs)
+                metrics.observe(f"kie.{endpoint}", time.perf_counter() - started)
                 return data
+            except (aiohttp.ClientError, asyncio.TimeoutError, KieTransientError) as e:
+                metrics.inc(f"kie.{endpoint}.errors")
+                if attempt >= self.retries or not self._retryable(method, e):
+                    raise
+                attempt += 1
+                metrics.inc(f"kie.{endpoint}.retries")
+                delay = random.uniform(0, 0.5 * 2 ** attempt)
+                logging.warning("KIE %s %s failed (%s), retry %s in %.2fs", method, endpoint, e, attempt, delay)
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    def _retryable(method: str, error: Exception) -> bool:
+        if method == "GET":
+            return True
+        # запрос до KIE не дошёл либо KIE сам попросил подождать
+        if isinstance(error, aiohttp.ClientConnectorError):
+            return True
+        return isinstance(error, KieTransientError) and error.status == 429
+
+    @classmethod
+    async def _send(cls, session: aiohttp.ClientSession, method: str, url: str, **kwargs) -> dict:
+        async with session.request(method, url, **kwargs) as r:
+            if r.status in cls.RETRY_STATUSES:
+                raise KieTransientError(r.status, f"KIE HTTP {r.status}")
+            data = await r.json()
+            # KIE всегда возвращает HTTP 200, но внутри есть поле code
+            if isinstance(data, dict) and data.get("code") in cls.RETRY_STATUSES:
+                raise KieTransientError(data["code"], f"KIE error: {data}")
+            if not isinstance(data, dict) or data.get("code") != 200:
+                raise RuntimeError(f"KIE error: {data}")
+            return data
 
     async def generate_video_by_text(self, prompt: str, aspect_ratio: str):
         url = "https://api.kie.ai/api/v1/veo/generate"
         payload = {
             "prompt": prompt, 
-            "model": "veo3_fast", 
+            "model": self.MODEL, 
             "aspectRatio": aspect_ratio,
             "callBackUrl": self.callback_url, 
             "enableFallback": False}
@@ -42,9 +125,13 @@ class GenerateRequests:
         payload = {
             "prompt": prompt, 
             "imageUrls": [imageUrl], 
-            "model": "veo3_fast",
+            "model": self.MODEL,
             "aspectRatio": aspect_ratio,
             "callBackUrl": self.callback_url,
             "enableFallback": False, }
         headers = {"Content-Type": "application/json"}
         return await self._request("POST", url, json=payload, headers=headers)
+
+
+# общий клиент приложения; закрывается на shutdown
+kie_client = GenerateRequests()
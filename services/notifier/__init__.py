@@ -12,6 +12,7 @@ class BotNotifier:
     def __init__(self):
         self.env = ENV()
         self.url = f"{self.env.BASE_URL}/internal/veo/video-ready"
+        self.failed_url = f"{self.env.BASE_URL}/internal/veo/video-failed"
 
     async def video_ready(
         self,
@@ -42,3 +43,12 @@ class BotNotifier:
         async with aiohttp.ClientSession() as s:
             async with s.post(self.url, json=payload, headers=headers) as r:
                 await r.read()
+
+    async def video_failed(self, *, chat_id: str, task_id: str, reason: Optional[str] = None) -> None:
+        if not self.failed_url:
+            return
+        headers = {"Content-Type": "application/json", "X-API-KEY": self.env.bot_api_token}
+        payload = {"chat_id": str(chat_id), "task_id": task_id, "reason": reason}
+        async with aiohttp.ClientSession() as s:
+            async with s.post(self.failed_url, json=payload, headers=headers) as r:
+                await r.read()
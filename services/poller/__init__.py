@@ -0,0 +1,129 @@
+from __future__ import annotations
+import asyncio
+import logging
+import time
+from contextlib import suppress
+from typing import Awaitable, Callable, Optional
+
+from services.kie import GenerateRequests
+from services.redis import RedisClient
+from services.veo import VeoService
+from utils.metrics import metrics
+
+
+OnFailed = Callable[[str, Optional[str]], Awaitable[None]]
+
+
+class KieStatusPoller:
+    """
+    Опрос статусов незавершённых задач KIE (record-info).
+
+    Раз в `interval` секунд один воркер (блокировка в Redis) берёт задачи из
+    veo:tasks:inflight, опрашивает те, чья очередь подошла, не больше `concurrency`
+    одновременно через общий клиент KIE, и пишет статус
+    в veo:status:{task_id} — по нему прогресс-бар понимает, что видео действительно готово.
+    Старые задачи опрашиваются реже. Упавшая задача отдаётся в on_failed сразу,
+    не дожидаясь колбэка.
+    """
+    LOCK = "veo:poller:lock"
+
+    def __init__(
+        self,
+        on_failed: OnFailed,
+        gen: GenerateRequests,
+        interval: float = 10.0,
+        concurrency: int = 8,
+        max_age: int = 172800,
+        redis: Optional[RedisClient] = None,
+    ):
+        self.on_failed = on_failed
+        self.interval = interval
+        self.concurrency = concurrency
+        self.max_age = max_age
+        self.redis = redis or RedisClient()
+        self.gen = gen
+        self._task: Optional[asyncio.Task] = None
+
+    def period(self, age: float) -> float:
+        """Пауза между опросами задачи в зависимости от её возраста."""
+        if age < 300:
+            return self.interval
+        if age < 900:
+            return self.interval * 3
+        return self.interval * 12
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run(), name="kie-status-poller")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if await self.redis.set_once(self.LOCK, ttl=max(1, int(self.interval))):
+                    with metrics.timer("kie.poller.round"):
+                        await self.poll_once()
+            except Exception as e:
+                logging.warning("KIE status poll failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    async def poll_once(self) -> int:
+        """Один проход по задачам, которым пора; возвращает число опрошенных."""
+        now = time.time()
+        tasks = await self.redis.inflight_tasks()
+        expired = [task_id for task_id, created_at in tasks if now - created_at > self.max_age]
+        if expired:
+            await self.redis.drop_inflight(*expired)
+        tasks = [(task_id, created_at) for task_id, created_at in tasks if now - created_at <= self.max_age]
+        statuses = await self.redis.get_statuses([task_id for task_id, _ in tasks])
+
+        due = []
+        for (task_id, created_at), status in zip(tasks, statuses):
+            status = status or {}
+            # готовое видео ждёт колбэка, опрашивать его дальше незачем
+            if status.get("status") == "success":
+                continue
+            checked_at = status.get("checked_at", 0)
+            if now - checked_at >= self.period(now - created_at):
+                due.append((task_id, created_at))
+        metrics.inc("kie.poller.skipped", len(tasks) - len(due))
+
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def _guarded(task_id: str, created_at: float) -> None:
+            async with sem:
+                await self._poll(task_id, created_at)
+
+        await asyncio.gather(*(_guarded(task_id, created_at) for task_id, created_at in due))
+        return len(due)
+
+    async def _poll(self, task_id: str, created_at: float) -> None:
+        try:
+            with metrics.timer("kie.poller.request"):
+                raw = await self.gen.get_video_info(task_id=task_id)
+        except Exception as e:
+            metrics.inc("kie.poller.errors")
+            logging.debug("record-info %s failed: %s", task_id, e)
+            return
+        data = (raw or {}).get("data") or {}
+        status = VeoService._status_from_record_info(data)
+        error = (data.get("errorMessage") or "").strip() or None
+        await self.redis.set_status(task_id, {
+            "status": status,
+            "checked_at": time.time(),
+            "age": int(time.time() - created_at),
+            "error": error,
+        })
+        metrics.inc(f"kie.poller.{status}")
+        if status == "failed":
+            try:
+                await self.on_failed(task_id, error)
+            except Exception:
+                logging.exception("Failed to finalize failed task %s", task_id)
@@ -0,0 +1,146 @@
+from __future__ import annotations
+import asyncio
+import logging
+import time
+from contextlib import suppress
+from typing import Callable, Dict, Optional
+
+from api.database import async_session_maker
+from services.kie import GenerateRequests
+from services.redis import RedisClient
+from services.veo import VeoService
+from utils.metrics import metrics
+
+
+class StaleTaskReconciler:
+    """
+    Доводит до конца задачи, колбэк которых так и не пришёл.
+
+    Раз в `interval` секунд один воркер (блокировка в Redis) берёт из veo:tasks:inflight
+    задачи старше `grace`, запрашивает record-info не больше `concurrency` одновременно и:
+      - success — прогоняет через обычную обработку колбэка (S3, доставка, completed_at);
+        настоящий колбэк, если всё же придёт, увидит готовый результат;
+      - failed, или задача висит дольше `timeout` — возврат монеты и сообщение (fail_task).
+    Заодно возвращает монеты по резервам старше `grace`, не привязанным к задаче.
+    Задачу, которую KIE не отдаёт (ошибка запроса), оставляем до следующего прохода.
+    Число зависших задач и возраст самой старой — в гаугах reconciler.stuck / reconciler.oldest_age.
+    """
+    LOCK = "veo:reconciler:lock"
+
+    def __init__(
+        self,
+        make_service: Callable[[], VeoService],
+        gen: GenerateRequests,
+        interval: float = 300.0,
+        grace: int = 900,
+        timeout: int = 10800,
+        concurrency: int = 8,
+        batch: int = 500,
+        redis: Optional[RedisClient] = None,
+    ):
+        self.make_service = make_service
+        self.gen = gen
+        self.interval = interval
+        self.grace = grace
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.batch = batch
+        self.redis = redis or RedisClient()
+        self._task: Optional[asyncio.Task] = None
+        self._stuck = 0
+        self._oldest = 0.0
+        metrics.gauge("reconciler.stuck", lambda: self._stuck)
+        metrics.gauge("reconciler.oldest_age", lambda: self._oldest)
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run(), name="stale-task-reconciler")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                if await self.redis.set_once(self.LOCK, ttl=max(1, int(self.interval))):
+                    with metrics.timer("reconciler.round"):
+                        report = await self.reconcile_once()
+                    if report["stuck"]:
+                        logging.info("reconciler: %s", report)
+            except Exception as e:
+                logging.warning("Stale task reconcile failed: %s", e)
+
+    async def reconcile_once(self) -> Dict[str, float]:
+        """Один проход; возвращает счётчики исходов, число зависших задач и возраст самой старой."""
+        now = time.time()
+        stale = [
+            (task_id, created_at)
+            for task_id, created_at in await self.redis.inflight_tasks(limit=self.batch)
+            if now - created_at > self.grace
+        ]
+        self._stuck = len(stale)
+        self._oldest = round(now - stale[0][1]) if stale else 0.0
+
+        report: Dict[str, float] = {"stuck": self._stuck, "oldest_age": self._oldest}
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def _guarded(task_id: str, created_at: float) -> None:
+            async with sem:
+                outcome = await self._reconcile(task_id, now - created_at)
+            report[outcome] = report.get(outcome, 0) + 1
+            metrics.inc(f"reconciler.{outcome}")
+
+        await asyncio.gather(*(_guarded(task_id, created_at) for task_id, created_at in stale))
+
+        # резервы монет, так и не дошедшие до KIE (процесс упал между списанием и ответом KIE)
+        try:
+            async with async_session_maker() as session:
+                report["stale_reservations"] = await self.make_service().ledger.refund_stale(session, older_than=self.grace)
+            metrics.inc("reconciler.stale_reservations", report["stale_reservations"])
+        except Exception as e:
+            logging.warning("Stale reservation refund failed: %s", e)
+        return report
+
+    async def _reconcile(self, task_id: str, age: float) -> str:
+        try:
+            raw = await self.gen.get_video_info(task_id=task_id)
+        except Exception as e:
+            logging.debug("record-info %s failed: %s", task_id, e)
+            return "errors"
+        data = (raw or {}).get("data") or {}
+        status = VeoService._status_from_record_info(data)
+
+        svc = self.make_service()
+        try:
+            async with async_session_maker() as session:
+                chat_id = await svc.tasks.get_chatID_by_taskID(task_id, session)
+                if status == "success":
+                    # тот же вид, что у колбэка KIE: обработка общая и идемпотентна по taskId
+                    payload = {
+                        "code": 200,
+                        "msg": "reconciled",
+                        "data": {
+                            "taskId": task_id,
+                            "info": data.get("response") or {},
+                            "fallbackFlag": data.get("fallbackFlag", False),
+                        },
+                    }
+                    result = await svc.process_callback(payload, session)
+                    return "delivered" if result.get("status") in ("success", "done") else "pending"
+                if status == "failed":
+                    reason = (data.get("errorMessage") or "").strip() or None
+                    await svc.fail_task(task_id, session, chat_id=chat_id, reason=reason)
+                    return "failed"
+                if age > self.timeout:
+                    await svc.fail_task(task_id, session, chat_id=chat_id, reason="timeout")
+                    return "timed_out"
+                return "pending"
+        except Exception:
+            logging.exception("Failed to reconcile task %s", task_id)
+            return "errors"
@@ -16,7 +16,11 @@ class RedisClient:
             "meta": meta or {},
             "created_at": int(time.time()),
         }
-        await self.redis.set(f"veo:task:{task_id}", json.dumps(payload), ex=ttl)
+        # veo:tasks:inflight — индекс незавершённых задач для поллера статусов
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(f"veo:task:{task_id}", json.dumps(payload), ex=ttl)
+            pipe.zadd("veo:tasks:inflight", {task_id: payload["created_at"]})
+            await pipe.execute()
 
     async def get_task(self, task_id: str) -> Optional[dict[str, Any]]:
         raw = await self.redis.get(f"veo:task:{task_id}")
@@ -28,7 +32,84 @@ class RedisClient:
             return None
 
     async def del_task(self, task_id: str) -> int:
-        return await self.redis.delete(f"veo:task:{task_id}")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.get(f"veo:task:{task_id}")
+            pipe.delete(f"veo:task:{task_id}")
+            pipe.zrem("veo:tasks:inflight", task_id)
+            raw, deleted, _ = await pipe.execute()
+        if raw:
+            # освобождаем слот пользователя в контроле допуска
+            try:
+                await self.redis.zrem(f"veo:admission:user:{json.loads(raw)['chat_id']}", task_id)
+            except (ValueError, KeyError):
+                pass
+        return deleted
+
+    async def inflight_tasks(self, limit: int = 1000) -> list[tuple[str, float]]:
+        """(task_id, created_at) незавершённых задач, старые первыми."""
+        return await self.redis.zrange("veo:tasks:inflight", 0, limit - 1, withscores=True)
+
+    async def drop_inflight(self, *task_ids: str) -> int:
+        if not task_ids:
+            return 0
+        return await self.redis.zrem("veo:tasks:inflight", *task_ids)
+
+    async def set_status(self, task_id: str, status: dict, ttl: int = 172800) -> None:
+        await self.redis.set(f"veo:status:{task_id}", json.dumps(status, separators=(",", ":")), ex=ttl)
+
+    async def get_statuses(self, task_ids: list[str]) -> list[Optional[dict[str, Any]]]:
+        if not task_ids:
+            return []
+        result = []
+        for raw in await self.redis.mget([f"veo:status:{task_id}" for task_id in task_ids]):
+            try:
+                result.append(json.loads(raw) if raw else None)
+            except Exception:
+                result.append(None)
+        return result
+
+    # --- контроль допуска к KIE: занятые слоты = задачи в veo:tasks:inflight моложе horizon
+    # + резервы veo:admission:reserved (token -> истечение); на пользователя — veo:admission:user:{chat_id} ---
+
+    _ADMIT = """
+    local now = tonumber(ARGV[1])
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+    redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', now)
+    local total = redis.call('ZCOUNT', KEYS[1], now - tonumber(ARGV[2]), '+inf') + redis.call('ZCARD', KEYS[2])
+    if total >= tonumber(ARGV[4]) then return 0 end
+    if redis.call('ZCARD', KEYS[3]) >= tonumber(ARGV[5]) then return -1 end
+    redis.call('ZADD', KEYS[2], now + tonumber(ARGV[3]), ARGV[6])
+    redis.call('ZADD', KEYS[3], now + tonumber(ARGV[3]), ARGV[6])
+    redis.call('EXPIRE', KEYS[3], ARGV[2])
+    return 1
+    """
+
+    async def admission_try(self, token: str, chat_id: str, global_limit: int, user_limit: int, horizon: int, lease: int = 120) -> int:
+        """1 — слот зарезервирован под token, 0 — занят общий лимит, -1 — лимит пользователя."""
+        return int(await self.redis.eval(
+            self._ADMIT, 3,
+            "veo:tasks:inflight", "veo:admission:reserved", f"veo:admission:user:{chat_id}",
+            time.time(), horizon, lease, global_limit, user_limit, token,
+        ))
+
+    async def admission_user_count(self, chat_id: str) -> int:
+        """Слоты пользователя: задачи в работе и резервы."""
+        return int(await self.redis.zcount(f"veo:admission:user:{chat_id}", time.time(), "+inf"))
+
+    async def admission_commit(self, token: str, chat_id: str, task_id: str, horizon: int) -> None:
+        """Резерв превращается в задачу: общий слот теперь держит veo:tasks:inflight."""
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem("veo:admission:reserved", token)
+            pipe.zrem(f"veo:admission:user:{chat_id}", token)
+            pipe.zadd(f"veo:admission:user:{chat_id}", {task_id: time.time() + horizon})
+            pipe.expire(f"veo:admission:user:{chat_id}", horizon)
+            await pipe.execute()
+
+    async def admission_release(self, token: str, chat_id: str) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem("veo:admission:reserved", token)
+            pipe.zrem(f"veo:admission:user:{chat_id}", token)
+            await pipe.execute()
 
     async def set_prompt(self, key: str, value: Any, ttl: int = 3600) -> None:
         await self.redis.set(key, str(value), ex=ttl)
@@ -54,3 +135,136 @@ class RedisClient:
             return str(raw)
         except Exception:
             return None
+
+    async def get_json(self, key: str) -> Optional[Any]:
+        raw = await self.redis.get(key)
+        if not raw:
+            return None
+        try:
+            return json.loads(raw)
+        except Exception:
+            return None
+
+    async def set_json(self, key: str, value: Any, ttl: int = 60) -> None:
+        await self.redis.set(key, json.dumps(value, separators=(",", ":")), ex=ttl)
+
+    async def delete(self, *keys: str) -> int:
+        if not keys:
+            return 0
+        return await self.redis.delete(*keys)
+
+    async def set_once(self, key: str, ttl: int, value: Any = "1") -> bool:
+        """SET NX EX: True — ключ поставлен этим вызовом, False — он уже был."""
+        return bool(await self.redis.set(key, str(value), ex=ttl, nx=True))
+
+    # --- реестр прогресс-баров: progress:{key} -> JSON, progress:index — ZSET key -> started_at ---
+
+    async def set_progress(self, key: str, record: dict, ttl: int = 7200) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(f"progress:{key}", json.dumps(record, separators=(",", ":")), ex=ttl)
+            pipe.zadd("progress:index", {key: record.get("started_at", int(time.time()))})
+            await pipe.execute()
+
+    async def pop_progress(self, key: str) -> Optional[dict[str, Any]]:
+        """Забирает запись атомарно: финализирует бар ровно один воркер."""
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.get(f"progress:{key}")
+            pipe.delete(f"progress:{key}")
+            pipe.zrem("progress:index", key)
+            raw, _, _ = await pipe.execute()
+        if not raw:
+            return None
+        try:
+            return json.loads(raw)
+        except Exception:
+            return None
+
+    async def progress_exists(self, keys: list[str]) -> list[bool]:
+        if not keys:
+            return []
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.exists(f"progress:{key}")
+            return [bool(n) for n in await pipe.execute()]
+
+    async def stale_progress(self, older_than: float, limit: int = 500) -> list[str]:
+        return await self.redis.zrangebyscore("progress:index", "-inf", older_than, start=0, num=limit)
+
+    # --- кэш результатов генерации: veo:result:{key} -> JSON, veo:results — ZSET key -> время записи ---
+
+    async def get_result(self, key: str) -> Optional[dict[str, Any]]:
+        return await self.get_json(f"veo:result:{key}")
+
+    async def set_result(self, key: str, value: dict, ttl: int, limit: int) -> None:
+        """Пишет результат и вытесняет самые старые записи сверх `limit`."""
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(f"veo:result:{key}", json.dumps(value, separators=(",", ":")), ex=ttl)
+            pipe.zadd("veo:results", {key: time.time()})
+            pipe.zremrangebyscore("veo:results", "-inf", time.time() - ttl)
+            pipe.zcard("veo:results")
+            *_, size = await pipe.execute()
+        if size > limit:
+            evicted = [k for k, _ in await self.redis.zpopmin("veo:results", size - limit)]
+            if evicted:
+                await self.redis.delete(*(f"veo:result:{k}" for k in evicted))
+
+    # --- реестр медиа: media:{kind}:{digest} -> Telegram file_id ---
+
+    async def get_media_id(self, kind: str, digest: str) -> Optional[str]:
+        return await self.redis.get(f"media:{kind}:{digest}")
+
+    async def set_media_id(self, kind: str, digest: str, file_id: str, ttl: int = 2592000) -> None:
+        await self.redis.set(f"media:{kind}:{digest}", file_id, ex=ttl)
+
+    async def forget_media_id(self, kind: str, digest: str) -> None:
+        await self.redis.delete(f"media:{kind}:{digest}")
+
+    async def push_dead_letter(self, name: str, item: dict, limit: int = 1000) -> None:
+        """Кладёт запись в dead-letter список `dead:{name}`, хранятся последние `limit`."""
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.lpush(f"dead:{name}", json.dumps(item, separators=(",", ":"), default=str))
+            pipe.ltrim(f"dead:{name}", 0, limit - 1)
+            await pipe.execute()
+
+    # --- состояние обработки колбэка KIE: veo:cb:{task_id} — hash state/lease/result ---
+    # received (колбэк принят) -> processing (взят с арендой) -> done (результат сохранён)
+
+    _CB_RECEIVE = """
+    local created = redis.call('HSETNX', KEYS[1], 'state', 'received')
+    if created == 1 then redis.call('EXPIRE', KEYS[1], ARGV[1]) end
+    return {created, redis.call('HGET', KEYS[1], 'state'), redis.call('HGET', KEYS[1], 'result') or ''}
+    """
+    _CB_CLAIM = """
+    local state = redis.call('HGET', KEYS[1], 'state')
+    if state == 'done' then return {'done', redis.call('HGET', KEYS[1], 'result') or ''} end
+    if state == 'processing' and tonumber(redis.call('HGET', KEYS[1], 'lease') or '0') > tonumber(ARGV[1]) then
+        return {'busy', ''}
+    end
+    redis.call('HSET', KEYS[1], 'state', 'processing', 'lease', tonumber(ARGV[1]) + tonumber(ARGV[2]))
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    return {'claimed', ''}
+    """
+
+    async def callback_receive(self, task_id: str, ttl: int = 172800) -> tuple[bool, str, Optional[dict]]:
+        """(создано этим вызовом, текущее состояние, результат для done) — один round trip."""
+        created, state, raw = await self.redis.eval(self._CB_RECEIVE, 1, f"veo:cb:{task_id}", ttl)
+        return bool(created), state, json.loads(raw) if raw else None
+
+    async def callback_claim(self, task_id: str, lease: int = 600, ttl: int = 172800) -> tuple[str, Optional[dict]]:
+        """CAS в processing: 'claimed' — обрабатываем мы, 'busy' — другой воркер, 'done' — уже готово."""
+        state, raw = await self.redis.eval(self._CB_CLAIM, 1, f"veo:cb:{task_id}", int(time.time()), lease, ttl)
+        return state, json.loads(raw) if raw else None
+
+    async def callback_done(self, task_id: str, result: dict, ttl: int = 172800) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(f"veo:cb:{task_id}", mapping={"state": "done", "result": json.dumps(result, separators=(",", ":"))})
+            pipe.hdel(f"veo:cb:{task_id}", "lease")
+            pipe.expire(f"veo:cb:{task_id}", ttl)
+            await pipe.execute()
+
+    async def callback_release(self, task_id: str) -> None:
+        """Обработка упала — колбэк снова можно взять."""
+        await self.redis.hset(f"veo:cb:{task_id}", mapping={"state": "received", "lease": 0})
+
+    async def callback_forget(self, task_id: str) -> None:
+        await self.redis.delete(f"veo:cb:{task_id}")
@@ -2,14 +2,39 @@ import uuid
 import boto3
 from config import ENV
 
+import asyncio
+import hashlib
+import logging
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Optional
 from urllib.parse import urlparse, quote
 
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
+from utils.metrics import metrics
+
+_env = ENV()
+# одновременных потоковых загрузок на процесс: каждая держит в памяти до (parts_in_flight + 1) частей
+_transfers = asyncio.Semaphore(_env.s3_max_transfers)
+_active = 0
+metrics.gauge("storage.transfers.active", lambda: _active)
+
 
 class YandexS3Storage:
+    """
+    Хранилище в Yandex Object Storage. Один экземпляр на процесс (get_storage).
+
+    boto3 синхронный, поэтому все сетевые вызовы идут в собственный пул потоков
+    размера s3_pool_size (столько же соединений в пуле клиента), а event loop
+    только ждёт результат. Бакет проверяется один раз — в start() или перед
+    первой операцией. Каждая операция пишет тайминг storage.<op>.
+    """
+
     def __init__(self):
         self.settings = ENV()
         self.bucket = "veobot"
@@ -19,10 +44,29 @@ class YandexS3Storage:
             endpoint_url=self.settings.yc_s3_endpoint_url,
             aws_access_key_id=self.settings.yc_s3_access_key_id,
             aws_secret_access_key=self.settings.yc_s3_secret_access_key,
+            config=Config(max_pool_connections=self.settings.s3_pool_size, retries={"mode": "standard"}),
         )
         # если бакет приватный — задай в ENV флаг yc_s3_public_bucket=False
         self.public_bucket = getattr(self.settings, "yc_s3_public_bucket", True)
-        self._ensure_bucket_exists()
+        self._executor = ThreadPoolExecutor(max_workers=self.settings.s3_pool_size, thread_name_prefix="s3")
+        self._bucket_checked = False
+
+    async def start(self) -> None:
+        await self._ensure_bucket()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+    async def _call(self, op: str, fn: Callable[..., Any], **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        with metrics.timer(f"storage.{op}"):
+            return await loop.run_in_executor(self._executor, partial(fn, **kwargs))
+
+    async def _ensure_bucket(self) -> None:
+        # без блокировки: параллельная повторная проверка безвредна
+        if not self._bucket_checked:
+            await self._call("head_bucket", self._ensure_bucket_exists)
+            self._bucket_checked = True
 
     def _ensure_bucket_exists(self):
         try:
@@ -34,22 +78,159 @@ class YandexS3Storage:
             else:
                 raise
 
-    def save(self, file_bytes: bytes, extension: str, *, prefix: str = "", storage_class: str = "COLD") -> str:
+    async def _exists(self, key: str) -> Optional[int]:
+        """Размер объекта, если он уже есть в бакете, иначе None."""
+        try:
+            head = await self._call("head_object", self.s3.head_object, Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return int(head.get("ContentLength") or 0)
+
+    async def _dedup(self, key: str) -> bool:
+        """Контент-адресуемый режим: объект уже загружен — считаем сэкономленное и не грузим."""
+        if not self.settings.yc_s3_content_addressed:
+            return False
+        size = await self._exists(key)
+        if size is None:
+            return False
+        metrics.inc("storage.dedup.hits")
+        metrics.inc("storage.dedup.bytes_saved", size)
+        return True
+
+    async def save(self, file_bytes: bytes, extension: str, *, prefix: str = "", storage_class: str = "COLD") -> str:
         # поддержка extension и с точкой, и без
         if extension and not extension.startswith("."):
             extension = f".{extension}"
-        filename = f"{uuid.uuid4()}{extension or ''}"
-        key = f"{prefix}{filename}"
+        if self.settings.yc_s3_content_addressed:
+            # одинаковые файлы — один объект: имя из sha256 содержимого
+            loop = asyncio.get_running_loop()
+            filename = await loop.run_in_executor(self._executor, lambda: hashlib.sha256(file_bytes).hexdigest())
+        else:
+            filename = str(uuid.uuid4())
+        key = f"{prefix}{filename}{extension or ''}"
 
-        self.s3.put_object(
+        await self._ensure_bucket()
+        if await self._dedup(key):
+            return f"{self.public_base}/{quote(key)}"
+        await self._call(
+            "put_object",
+            self.s3.put_object,
             Bucket=self.bucket,
             Key=key,
             Body=file_bytes,
             StorageClass=storage_class,
         )
+        metrics.inc("storage.upload.bytes", len(file_bytes))
         # если бакет публичный — вернём постоянную ссылку
         return f"{self.public_base}/{quote(key)}"
 
+    async def save_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        extension: str,
+        *,
+        prefix: str = "",
+        storage_class: str = "COLD",
+        name: Optional[str] = None,
+    ) -> str:
+        """
+        Потоковая загрузка: куски из chunks собираются в части по s3_part_size_mb
+        и уходят multipart upload'ом, до s3_parts_in_flight частей параллельно
+        (boto3 — в пуле потоков хранилища). Файл меньше одной части
+        уходит обычным put_object.
+
+        name — постоянное имя объекта (например, taskId). В контент-адресуемом режиме
+        уже загруженный объект с этим именем не перезаливается, а chunks не читаются.
+        """
+        global _active
+        if extension and not extension.startswith("."):
+            extension = f".{extension}"
+        key = f"{prefix}{name or uuid.uuid4()}{extension or ''}"
+        part_size = self.settings.s3_part_size_mb * 1024 * 1024
+
+        await self._ensure_bucket()
+        if name and await self._dedup(key):
+            return f"{self.public_base}/{quote(key)}"
+        async with _transfers:
+            _active += 1
+            started = time.perf_counter()
+            try:
+                total = await self._upload_stream(chunks, key, part_size, storage_class)
+            finally:
+                _active -= 1
+        elapsed = time.perf_counter() - started
+        metrics.inc("storage.upload.bytes", total)
+        metrics.observe("storage.upload", elapsed)
+        if elapsed > 0:
+            metrics.observe("storage.upload.mbps", total / elapsed / 1024 / 1024)
+        return f"{self.public_base}/{quote(key)}"
+
+    async def _upload_stream(self, chunks: AsyncIterator[bytes], key: str, part_size: int, storage_class: str) -> int:
+        buffer = bytearray()
+        total = 0
+        upload_id = None
+        parts: list[asyncio.Task] = []
+        in_flight = asyncio.Semaphore(self.settings.s3_parts_in_flight)
+
+        async def _put_part(number: int, body: bytes) -> dict:
+            try:
+                resp = await self._call(
+                    "upload_part",
+                    self.s3.upload_part,
+                    Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=body,
+                )
+                return {"ETag": resp["ETag"], "PartNumber": number}
+            finally:
+                in_flight.release()
+
+        try:
+            async for chunk in chunks:
+                buffer += chunk
+                total += len(chunk)
+                while len(buffer) >= part_size:
+                    if upload_id is None:
+                        resp = await self._call(
+                            "create_multipart_upload",
+                            self.s3.create_multipart_upload,
+                            Bucket=self.bucket, Key=key, StorageClass=storage_class,
+                        )
+                        upload_id = resp["UploadId"]
+                    # ждём свободный слот — так в памяти не больше parts_in_flight частей
+                    await in_flight.acquire()
+                    body, buffer = bytes(buffer[:part_size]), buffer[part_size:]
+                    parts.append(asyncio.create_task(_put_part(len(parts) + 1, body)))
+
+            if upload_id is None:
+                await self._call(
+                    "put_object",
+                    self.s3.put_object,
+                    Bucket=self.bucket, Key=key, Body=bytes(buffer), StorageClass=storage_class,
+                )
+                return total
+            if buffer:
+                await in_flight.acquire()
+                parts.append(asyncio.create_task(_put_part(len(parts) + 1, bytes(buffer))))
+            uploaded = await asyncio.gather(*parts)
+            await self._call(
+                "complete_multipart_upload",
+                self.s3.complete_multipart_upload,
+                Bucket=self.bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": uploaded},
+            )
+            return total
+        except BaseException:
+            for task in parts:
+                task.cancel()
+            await asyncio.gather(*parts, return_exceptions=True)
+            if upload_id is not None:
+                try:
+                    await self._call("abort_multipart_upload", self.s3.abort_multipart_upload, Bucket=self.bucket, Key=key, UploadId=upload_id)
+                except Exception as e:
+                    logging.warning("abort multipart upload %s failed: %s", key, e)
+            metrics.inc("storage.upload.failed")
+            raise
+
     def get_file(
         self,
         key_or_url: str,
@@ -60,6 +241,8 @@ class YandexS3Storage:
         force_presign: bool = False,
     ) -> str:
         """
+        Подпись presigned URL считается локально, без сети, поэтому метод синхронный.
+
         Возвращает ссылку на объект в бакете:
           - публичная постоянная ссылка (если бакет публичный и force_presign=False)
           - presigned URL с TTL (если бакет приватный или force_presign=True)
@@ -98,3 +281,14 @@ class YandexS3Storage:
                 return path[len(self.bucket) + 1 :]
             return path
         return key_or_url
+
+
+_storage: Optional[YandexS3Storage] = None
+
+
+def get_storage() -> YandexS3Storage:
+    """Общий экземпляр хранилища процесса."""
+    global _storage
+    if _storage is None:
+        _storage = YandexS3Storage()
+    return _storage
@@ -1,13 +1,24 @@
 from __future__ import annotations
-from typing import Optional, Dict, Any
+import json
+import logging
+import time
+import uuid
+from typing import AsyncIterator, Awaitable, Callable, Optional, Dict, Any
 import aiohttp
 from sqlalchemy.ext.asyncio import AsyncSession
-from api.crud.user.schema import CoinMinus, CoinPlus
+from api.crud.user.schema import CoinPlus
 from api.crud.user import UserService, UserNotFound, BusinessRuleError
+from api.crud.task import TaskCRUD
+from api.crud.task.schema import TaskCreate
+from api.crud.ledger import LedgerCRUD
 from services.notifier import BotNotifier
 from services.redis import RedisClient
 from services.storage import YandexS3Storage
 from services.kie import GenerateRequests
+from services.admission import AdmissionController, AdmissionTimeout, AdmissionUserLimit, OnPosition
+from services.veo.cache import ResultCache
+from api.database import async_session_maker
+from utils.metrics import metrics
 
 
 class VeoServiceError(Exception): ...
@@ -21,40 +32,127 @@ class VeoService:
         storage: YandexS3Storage,
         redis: RedisClient,
         notifier: BotNotifier,
+        tasks: Optional[TaskCRUD] = None,
+        ledger: Optional[LedgerCRUD] = None,
+        admission: Optional[AdmissionController] = None,
+        partner_weight: float = 1.0,
     ):
         self.users = users
         self.gen = gen
         self.storage = storage
         self.redis = redis
         self.notifier = notifier
+        self.tasks = tasks or TaskCRUD()
+        self.ledger = ledger or LedgerCRUD()
+        self.admission = admission
+        self.partner_weight = partner_weight
+        self.cache = ResultCache(redis, model=gen.MODEL)
 
-    async def generate_by_text(self, chat_id: str, prompt: str, aspect_ratio: str, session: AsyncSession) -> dict:
-        await self._charge_one_coin(chat_id, session)
-        try:
-            resp = await self.gen.generate_video_by_text(prompt=prompt, aspect_ratio=aspect_ratio)
-            task_id = self._parse_task_id(resp)
-            if not task_id:
-                raise VeoServiceError(f"KIE response has no taskId: {resp}")
-            await self.redis.set_task(task_id, chat_id, meta={"mode": "text", "prompt": prompt, "aspect_ratio": aspect_ratio})
-            return {"task_id": task_id, "raw": resp}
-        except Exception:
-            await self._refund_one_coin(chat_id, session)
-            raise
+    async def generate_by_text(
+        self, chat_id: str, prompt: str, aspect_ratio: str, session: AsyncSession, on_position: Optional[OnPosition] = None,
+        fresh: bool = False,
+    ) -> dict:
+        meta = {"mode": "text", "prompt": prompt, "aspect_ratio": aspect_ratio}
+        cached = await self._from_cache(chat_id, meta, fresh, session)
+        if cached:
+            return cached
+        return await self._submit(
+            chat_id, meta, session, on_position,
+            lambda: self.gen.generate_video_by_text(prompt=prompt, aspect_ratio=aspect_ratio),
+        )
 
-    async def generate_by_photo(self, chat_id: str, prompt: str, aspect_ratio: str, image_url: str | None, session: AsyncSession) -> dict:
+    async def generate_by_photo(
+        self, chat_id: str, prompt: str, aspect_ratio: str, image_url: str | None, session: AsyncSession,
+        on_position: Optional[OnPosition] = None,
+        fresh: bool = False,
+    ) -> dict:
         if image_url:
             input_url = image_url
-        await self._charge_one_coin(chat_id, session)
+        meta = {"mode": "photo", "prompt": prompt, "input_image_url": input_url, "aspect_ratio": aspect_ratio}
+        cached = await self._from_cache(chat_id, meta, fresh, session)
+        if cached:
+            return {**cached, "input_image_url": input_url}
+        data = await self._submit(
+            chat_id, meta, session, on_position,
+            lambda: self.gen.generate_video_by_photo(prompt=prompt, imageUrl=input_url, aspect_ratio=aspect_ratio),
+        )
+        return {**data, "input_image_url": input_url}
+
+    async def _submit(
+        self,
+        chat_id: str,
+        meta: dict,
+        session: AsyncSession,
+        on_position: Optional[OnPosition],
+        send: Callable[[], Awaitable[dict]],
+    ) -> dict:
+        """
+        Слот KIE → резерв монеты → задача в KIE → consume и запись задачи одной транзакцией.
+        Ошибка до consume — резерв возвращается ровно один раз, слот освобождается.
+        После consume задача уже идёт и записана в БД: ни возврата, ни освобождения слота,
+        владельца (при сбое Redis) колбэк и сверка берут из БД.
+        """
+        token = await self._admit(chat_id, on_position)
         try:
-            resp = await self.gen.generate_video_by_photo(prompt=prompt, imageUrl=input_url, aspect_ratio=aspect_ratio)
+            reservation = await self._reserve(chat_id, session)
+        except BaseException:
+            await self._release(token, chat_id)
+            raise
+        try:
+            resp = await send()
             task_id = self._parse_task_id(resp)
             if not task_id:
                 raise VeoServiceError(f"KIE response has no taskId: {resp}")
-            await self.redis.set_task(task_id, chat_id, meta={"mode": "photo", "prompt": prompt, "input_image_url": input_url, "aspect_ratio": aspect_ratio})
-            return {"task_id": task_id, "raw": resp, "input_image_url": input_url}
+            await self.ledger.consume(reservation, chat_id, task_id, session, task=self._task_record(chat_id, task_id, meta))
         except Exception:
-            await self._refund_one_coin(chat_id, session)
+            await self._refund_reservation(reservation, session)
+            await self._release(token, chat_id)
             raise
+        try:
+            await self.redis.set_task(task_id, chat_id, meta=meta)
+        except Exception as e:
+            logging.warning("Failed to register task %s in Redis: %s", task_id, e)
+        await self._commit(token, chat_id, task_id)
+        return {"task_id": task_id, "raw": resp}
+
+    async def _from_cache(self, chat_id: str, meta: dict, fresh: bool, session: AsyncSession) -> Optional[dict]:
+        """
+        Такое видео уже генерировалось — списываем монету и отдаём его без KIE.
+        task_id — свой (cache-…): задача и списание пишутся одной транзакцией.
+        """
+        hit = await self.cache.lookup(meta, fresh=fresh)
+        if not hit:
+            return None
+        task_id = f"cache-{uuid.uuid4().hex}"
+        try:
+            await self.ledger.charge(chat_id, task_id, session, task=self._task_record(chat_id, task_id, meta))
+        except UserNotFound:
+            raise VeoServiceError("User not found")
+        except BusinessRuleError as e:
+            raise VeoServiceError(str(e))
+        return {
+            "task_id": task_id,
+            "raw": None,
+            "cached": True,
+            "result_url": hit["result_url"],
+        }
+
+    @staticmethod
+    def _task_record(chat_id: str, task_id: str, meta: dict) -> TaskCreate:
+        # тот же контекст, что бот читает для «Повторить генерацию»
+        raw = {
+            "prompt": meta.get("prompt"),
+            "mode": meta.get("mode"),
+            "aspect_ratio": meta.get("aspect_ratio"),
+            "image_url": meta.get("input_image_url"),
+        }
+        return TaskCreate(
+            task_id=task_id,
+            chat_id=str(chat_id),
+            raw=json.dumps(raw, ensure_ascii=False),
+            is_video=meta.get("mode") == "photo",
+            rating=0,
+        )
 
     async def get_status(self, task_id: str) -> dict:
         raw = await self.gen.get_video_info(task_id=task_id)
@@ -63,9 +161,88 @@ class VeoService:
         result_url = self._first_url(data.get("response", {}))
         return {"task_id": task_id, "status": status, "source_url": result_url, "raw": raw}
 
+    async def fail_task(
+        self,
+        task_id: str,
+        session: AsyncSession,
+        chat_id: Optional[str] = None,
+        reason: Optional[str] = None,
+    ) -> bool:
+        """
+        Задача KIE упала: возвращаем монету и сообщаем пользователю.
+        О падении узнают и колбэк, и поллер статусов — отметка в Redis
+        гарантирует, что возврат случится один раз. False — уже обработано.
+        """
+        # возврат по журналу однократен сам по себе, отметка ниже — для уведомления
+        refunded = await self.ledger.refund(session, task_id=task_id)
+        if not await self.redis.set_once(f"veo:failed:{task_id}", ttl=172800):
+            return False
+        if chat_id is None:
+            owner = await self.redis.get_task(task_id)
+            chat_id = owner.get("chat_id") if owner else None
+        await self.redis.del_task(task_id)
+        await self.redis.set_status(task_id, {"status": "failed", "checked_at": time.time(), "error": reason})
+        if not chat_id:
+            return True
+        if refunded is None:
+            # задача создана до журнала
+            await self._refund_one_coin(chat_id, session)
+        await self.notifier.video_failed(chat_id=chat_id, task_id=task_id, reason=reason)
+        return True
+
     # ---------- колбэк ----------
 
-    async def handle_callback(self, payload: dict) -> dict:
+    async def process_callback(self, payload: dict, session: AsyncSession) -> dict:
+        """
+        Полная обработка колбэка KIE — в запросе (callback_mode=inline) или в Celery:
+        неудача → возврат монеты и уведомление; видео → S3, уведомление, completed_at.
+
+        Идемпотентно по taskId: обработку берёт только тот, кто перевёл veo:cb:{taskId}
+        в processing; для done возвращается сохранённый результат, для чужого
+        processing — статус "processing". Упавшая обработка возвращает состояние
+        в received, и следующая доставка колбэка (или повтор Celery) возьмёт её снова.
+        done ставится только по итогу (видео сохранено или задача упала); колбэк без
+        ссылки на видео отметку снимает — следующая доставка или сверка доведут задачу.
+        """
+        task_id = ((payload or {}).get("data") or {}).get("taskId")
+        state, result = await self.redis.callback_claim(task_id)
+        if state == "done":
+            metrics.inc("veo.callback.duplicate")
+            return result or {"task_id": task_id, "status": "done"}
+        if state == "busy":
+            metrics.inc("veo.callback.duplicate")
+            return {"task_id": task_id, "status": "processing"}
+        try:
+            result = await self._process_callback(task_id, payload, session)
+        except BaseException:
+            await self.redis.callback_release(task_id)
+            raise
+        if result.get("status") in ("success", "failed"):
+            await self.redis.callback_done(task_id, result)
+        else:
+            await self.redis.callback_forget(task_id)
+        return result
+
+    async def _process_callback(self, task_id: str, payload: dict, session: AsyncSession) -> dict:
+        if payload.get("code") == 400:
+            chat_id = await self.tasks.get_chatID_by_taskID(task_id, session)
+            # возврат и уведомление — общие с поллером статусов, выполняются один раз
+            await self.fail_task(task_id, session, chat_id=chat_id, reason=payload.get("msg"))
+            return {"task_id": task_id, "status": "failed"}
+        # ключ veo:task живёт 48 ч — для поздних колбэков и сверки владелец берётся из БД
+        chat_id = None
+        owner = await self.redis.get_task(task_id)
+        if not owner:
+            chat_id = await self.tasks.get_chatID_by_taskID(task_id, session)
+        result = await self.handle_callback(payload, chat_id=chat_id)
+        if result.get("status") == "success":
+            # для оценки длительности генерации (GET /tasks/estimates)
+            await self.tasks.set_completed(task_id, session)
+            if owner:
+                await self.cache.store(owner.get("meta") or {}, task_id, result["result_url"])
+        return result
+
+    async def handle_callback(self, payload: dict, chat_id: Optional[str] = None) -> dict:
 
         data = (payload or {}).get("data") or {}
         task_id = data.get("taskId")
@@ -80,11 +257,14 @@ class VeoService:
 
         # достанем владельца задачи
         owner = await self.redis.get_task(task_id) if task_id else None
-        chat_id = int(owner["chat_id"]) if owner and "chat_id" in owner else None
+        if owner and "chat_id" in owner:
+            chat_id = owner["chat_id"]
+        chat_id = int(chat_id) if chat_id else None
 
         if src_url:
-            video_bytes = await self._download(src_url)
-            s3_url = self.storage.save(video_bytes, ".mp4", prefix="videos/")
+            # видео идёт из KIE в S3 кусками, целиком в памяти не лежит
+            # имя по taskId: повторный колбэк не создаёт второй объект
+            s3_url = await self.storage.save_stream(self._stream(src_url), ".mp4", prefix="videos/", name=task_id)
             result["result_url"] = s3_url
             result["source_url"] = src_url
 
@@ -93,11 +273,46 @@ class VeoService:
                 await self.notifier.video_ready(
                     chat_id=chat_id, task_id=task_id, result_url=s3_url, source_url=src_url, fallback=result["fallback"]
                 )
-                # ключ можно удалить — задача завершена
-                await self.redis.del_task(task_id)
+            # ключ можно удалить — задача завершена
+            await self.redis.del_task(task_id)
 
         return result
 
+    # ---------- допуск к KIE ----------
+
+    async def _admit(self, chat_id: str, on_position: Optional[OnPosition]) -> Optional[str]:
+        """Слот KIE до списания монеты: пока запрос в очереди, баланс не трогаем."""
+        if self.admission is None or not self.admission.enabled:
+            return None
+        try:
+            return await self.admission.acquire(chat_id, weight_of=lambda: self._weight(chat_id), on_position=on_position)
+        except (AdmissionTimeout, AdmissionUserLimit) as e:
+            raise VeoServiceError(str(e))
+
+    async def _weight(self, chat_id: str) -> float:
+        # отдельная короткая сессия: соединение запроса не держим, пока стоим в очереди
+        try:
+            async with async_session_maker() as session:
+                user = await self.users.get_user(chat_id, session)
+            return self.partner_weight if user.role == "partner" else 1.0
+        except Exception:
+            return 1.0
+
+    async def _commit(self, token: Optional[str], chat_id: str, task_id: str) -> None:
+        if token is not None:
+            try:
+                await self.admission.commit(token, chat_id, task_id)
+            except Exception as e:
+                # резерв истечёт сам, слот уже держит задача в veo:tasks:inflight
+                logging.warning("Failed to commit KIE slot for %s: %s", task_id, e)
+
+    async def _release(self, token: Optional[str], chat_id: str) -> None:
+        if token is not None:
+            try:
+                await self.admission.release(token, chat_id)
+            except Exception as e:
+                logging.warning("Failed to release KIE slot for %s: %s", chat_id, e)
+
     # ---------- helpers ----------
     @staticmethod
     def _parse_task_id(resp: dict) -> Optional[str]:
@@ -122,20 +337,31 @@ class VeoService:
                 return vals[0]
         return None
 
-    async def _download(self, url: str) -> bytes:
-        async with aiohttp.ClientSession() as sess:
+    async def _stream(self, url: str, chunk_size: int = 1024 * 1024) -> AsyncIterator[bytes]:
+        timeout = aiohttp.ClientTimeout(connect=10, sock_read=60)
+        async with aiohttp.ClientSession(timeout=timeout) as sess:
             async with sess.get(url) as r:
                 r.raise_for_status()
-                return await r.read()
+                async for chunk in r.content.iter_chunked(chunk_size):
+                    yield chunk
 
-    async def _charge_one_coin(self, chat_id: str, session: AsyncSession) -> None:
+    async def _reserve(self, chat_id: str, session: AsyncSession) -> str:
         try:
-            await self.users.minus_coin(CoinMinus(chat_id=chat_id), session)
+            return await self.ledger.reserve(chat_id, session)
         except UserNotFound:
             raise VeoServiceError("User not found")
         except BusinessRuleError as e:
             raise VeoServiceError(str(e))
 
+    async def _refund_reservation(self, reservation: str, session: AsyncSession) -> None:
+        try:
+            await session.rollback()
+            # consume мог успеть закоммититься — такой резерв уже оплачивает задачу
+            await self.ledger.refund(session, reservation_id=reservation, unconsumed=True)
+        except Exception:
+            # резерв без consume вернёт сверка (refund_stale)
+            logging.exception("Failed to refund reservation %s", reservation)
+
     async def _refund_one_coin(self, chat_id: str, session: AsyncSession) -> None:
         try:
             await self.users.plus_coins(CoinPlus(chat_id=chat_id, count=1), session)
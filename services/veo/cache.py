@@ -0,0 +1,81 @@
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+from config import ENV
+from services.redis import RedisClient
+from utils.metrics import metrics
+
+
+def result_key(prompt: str, aspect_ratio: Optional[str], image_url: Optional[str], model: str) -> str:
+    """
+    Ключ одинаковых запросов: промпт без лишних пробелов, формат, модель и изображение.
+    Изображение — по пути объекта без query; у контент-адресуемых загрузок это хэш содержимого.
+    """
+    image = ""
+    if image_url:
+        parts = urlsplit(image_url)
+        image = f"{parts.netloc}{parts.path}"
+    raw = json.dumps(
+        {"p": " ".join((prompt or "").split()), "a": aspect_ratio or "16:9", "i": image, "m": model},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Кэш готовых видео для одинаковых запросов (включается result_cache_ttl > 0).
+
+    После успешного колбэка видео в S3 запоминается по result_key на result_cache_ttl секунд,
+    записей не больше result_cache_max (старые вытесняются). Повтор того же запроса
+    получает это видео сразу, без обращения к KIE. fresh=True в запросе — «другой вариант»,
+    кэш пропускается.
+    """
+
+    def __init__(self, redis: RedisClient, model: str):
+        env = ENV()
+        self.redis = redis
+        self.model = model
+        self.ttl = env.result_cache_ttl
+        self.limit = env.result_cache_max
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def key(self, meta: Dict[str, Any]) -> str:
+        return result_key(meta.get("prompt"), meta.get("aspect_ratio"), meta.get("input_image_url"), self.model)
+
+    async def lookup(self, meta: Dict[str, Any], fresh: bool = False) -> Optional[dict]:
+        if not self.enabled:
+            return None
+        if fresh:
+            metrics.inc("veo.cache.bypass")
+            return None
+        try:
+            hit = await self.redis.get_result(self.key(meta))
+        except Exception as e:
+            logging.warning("result cache lookup failed: %s", e)
+            return None
+        metrics.inc("veo.cache.hit" if hit else "veo.cache.miss")
+        return hit
+
+    async def store(self, meta: Dict[str, Any], task_id: str, result_url: str) -> None:
+        if not self.enabled or not meta.get("prompt"):
+            return
+        try:
+            await self.redis.set_result(
+                self.key(meta),
+                {"result_url": result_url, "task_id": task_id, "created_at": int(time.time())},
+                ttl=self.ttl,
+                limit=self.limit,
+            )
+            metrics.inc("veo.cache.store")
+        except Exception as e:
+            logging.warning("result cache store failed: %s", e)
@@ -0,0 +1,28 @@
+import asyncio
+
+from aiogram.methods import SendMessage
+
+from bot.outbound import OutboundScheduler, Priority, outbound_priority
+
+
+def test_delivery_beats_reply_for_send_message():
+    async def scenario():
+        scheduler = OutboundScheduler(global_rate=1000.0, chat_rate=20.0, chat_burst=1.0)
+        sent = []
+
+        async def make_request(bot, method):
+            sent.append(method.text)
+
+        async def send(text, priority):
+            with outbound_priority(priority):
+                await scheduler(make_request, None, SendMessage(chat_id=1, text=text))
+
+        # первый токен бакета чата уходит сразу, остальные ждут пополнения
+        await send("first", Priority.REPLY)
+        reply = asyncio.create_task(send("reply", Priority.REPLY))
+        await asyncio.sleep(0)
+        delivery = asyncio.create_task(send("delivery", Priority.DELIVERY))
+        await asyncio.gather(reply, delivery)
+        return sent
+
+    assert asyncio.run(scenario()) == ["first", "delivery", "reply"]
@@ -0,0 +1,20 @@
+from __future__ import annotations
+from typing import Dict, Optional, Tuple
+
+
+# пока истории нет: типичная генерация veo3_fast
+DEFAULT_ESTIMATE = {"p50": 150.0, "p90": 240.0, "samples": 0}
+
+
+def estimate_key(mode: Optional[str], aspect_ratio: Optional[str]) -> str:
+    return f"{mode or 'text'}:{aspect_ratio or '16:9'}"
+
+
+def pick_estimate(estimates: Dict[str, dict], mode: Optional[str], aspect_ratio: Optional[str]) -> Tuple[float, float]:
+    """(p50, p90) для режима и формата; без своей статистики — по режиму, затем общая."""
+    mode = mode or "text"
+    for key in (estimate_key(mode, aspect_ratio), f"{mode}:*", "*"):
+        item = estimates.get(key)
+        if item:
+            return float(item["p50"]), float(item["p90"])
+    return DEFAULT_ESTIMATE["p50"], DEFAULT_ESTIMATE["p90"]
@@ -0,0 +1,63 @@
+from __future__ import annotations
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager, suppress
+from typing import Callable, Deque, Dict, Iterator
+
+
+class Metrics:
+    """
+    Реестр метрик процесса: счётчики, гауги и тайминги.
+    Снимок целиком отдаёт эндпоинт GET /metrics.
+    """
+
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self.counters: Dict[str, float] = defaultdict(float)
+        self.gauges: Dict[str, Callable[[], float]] = {}
+        self.timings: Dict[str, Deque[float]] = {}
+        self.timing_counts: Dict[str, int] = defaultdict(int)
+
+    def inc(self, name: str, value: float = 1) -> None:
+        self.counters[name] += value
+
+    def gauge(self, name: str, fn: Callable[[], float]) -> None:
+        """Гауга считается в момент снятия снимка."""
+        self.gauges[name] = fn
+
+    def observe(self, name: str, seconds: float) -> None:
+        samples = self.timings.get(name)
+        if samples is None:
+            samples = self.timings[name] = deque(maxlen=self.window)
+        samples.append(seconds)
+        self.timing_counts[name] += 1
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def snapshot(self) -> dict:
+        gauges = {}
+        for name, fn in self.gauges.items():
+            with suppress(Exception):
+                gauges[name] = fn()
+        timings = {}
+        for name, samples in self.timings.items():
+            if not samples:
+                continue
+            ordered = sorted(samples)
+            timings[name] = {
+                "count": self.timing_counts[name],
+                "mean": sum(ordered) / len(ordered),
+                "p50": ordered[len(ordered) // 2],
+                "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                "max": ordered[-1],
+            }
+        return {"counters": dict(self.counters), "gauges": gauges, "timings": timings}
+
+
+metrics = Metrics()
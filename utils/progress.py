@@ -1,83 +1,355 @@
+from __future__ import annotations
 import asyncio
+import heapq
+import itertools
+import logging
+import time
 from contextlib import suppress
-from typing import TypedDict, Dict
-from aiogram import Bot, types
-
+from typing import Dict, List, Optional, Tuple
 
-class _Progress(TypedDict):
-    task: asyncio.Task
-    chat_id: int
-    message_id: int
+from aiogram import Bot, types
 
+from bot.outbound import Priority, outbound_priority
+from config import ENV
+from services.redis import RedisClient
+from utils.metrics import metrics
 
-PROGRESS: Dict[str, _Progress] = {}
 
 # --- Прогресс‑бар ---
 
-
-async def show_progress(msg: types.Message, stage: str):
-    if stage == "prompt":
-        stages = [
+# stage -> (пауза между кадрами, кадры)
+STAGES: Dict[str, Tuple[float, List[str]]] = {
+    "prompt": (10, [
+        f"{percent}\n{bar}\n{note}" for percent, bar, note in (
             ("5%",  "🧠◼️◼️◼️◼️◼️◼️◼️◼️◼️ 5%",  "💬 Внимаю идее"),
             ("15%", "🧠🧠◼️◼️◼️◼️◼️◼️◼️◼️ 15%", "💬 Развожу роли и образы"),
             ("30%", "🧠🧠🧠◼️◼️◼️◼️◼️◼️◼️ 30%", "💬 Плету структуру текста"),
             ("60%", "🧠🧠🧠🧠🧠🧠◼️◼️◼️◼️ 60%", "💬 Придаю ритм и ясность"),
             ("95%", "🧠🧠🧠🧠🧠🧠🧠🧠🧠◼️ 95%", "💬 Запечатываю замысел"),
             ("100%", "🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠 100%", "💬 Промпт завершён 🌟"),
-        ]
-        delay = 10
-    else:  # stage == "video"
-        stages = [
+        )
+    ]),
+    "video": (30, [
+        f"{percent}\n{bar}\n{note}" for percent, bar, note in (
             ("5%",  "📹◼️◼️◼️◼️◼️◼️◼️◼️◼️ 5%",  "🔴 REC Оживляю сцену"),
             ("15%", "📹📹◼️◼️◼️◼️◼️◼️◼️◼️ 15%", "🔴 REC Веду движение"),
             ("30%", "📹📹📹◼️◼️◼️◼️◼️◼️◼️ 30%", "🔴 REC Зажигаю свет и краски"),
             ("60%", "📹📹📹📹📹📹◼️◼️◼️◼️ 60%", "🔴 REC Устраняю тени и шум"),
             ("95%", "📹📹📹📹📹📹📹📹📹◼️ 95%", "🔴 REC Последний мазок"),
             ("100%", "📹📹📹📹📹📹📹📹📹📹 100%", "🔴 REC Картинка ожила ✨"),
-        ]                       
-        delay = 30
-
-    for percent, bar, note in stages:
-            text = f"{percent}\n{bar}\n{note}"
-            with suppress(Exception):
-                await msg.edit_text(text)
-            await asyncio.sleep(delay)
-
-async def show_progress_msg(bot: Bot, chat_id: int, message_id: int, stage: str):
-    print("hello")
-    if stage == "prompt":
-        stages = [
-            ("5%",  "🟡⚫️⚫️⚫️⚫️⚫️⚫️⚫️⚫️⚫️ 5%",  "Читаю идею, ловлю суть."),
-            ("15%", "🟡🟡⚫️⚫️⚫️⚫️⚫️⚫️⚫️⚫️ 15%", "Разбираю: кто/что/где/стиль."),
-            ("30%", "🟡🟡🟡⚫️⚫️⚫️⚫️⚫️⚫️⚫️ 30%", "Собираю структуру, убираю воду."),
-            ("60%", "🟡🟡🟡🟡🟡🟡⚫️⚫️⚫️⚫️ 60%", "Шлифую формулировку, стыкую логику."),
-            ("95%", "🟡🟡🟡🟡🟡🟡🟡🟡🟡⚫️ 95%", "Упаковываю финальный промпт."),
-        ]
-        delay = 10
-    else:  # stage == "video"
-        stages = [
-            ("5%",  "🟡⚫️⚫️⚫️⚫️⚫️⚫️⚫️⚫️⚫️ 5%",  "Отправил на генерацию. Готовлю сцену."),
-            ("15%", "🟡🟡⚫️⚫️⚫️⚫️⚫️⚫️⚫️⚫️ 15%", "Собираю кадры и движение."),
-            ("30%", "🟡🟡🟡⚫️⚫️⚫️⚫️⚫️⚫️⚫️ 30%", "Добавляю свет, цвет, вайб."),
-            ("60%", "🟡🟡🟡🟡🟡🟡⚫️⚫️⚫️⚫️ 60%", "Сглаживаю артефакты, финальные стыки."),
-            ("95%", "🟡🟡🟡🟡🟡🟡🟡🟡🟡⚫️ 95%", "Готовлю ссылку. Ещё мгновение…"),
-        ]
-        delay = 30
-
-    for percent, bar, note in stages:
-        text = f"{percent}\n{bar}\n{note}"
-        await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id)
-        await asyncio.sleep(delay)
+        )
+    ]),
+}
+
+
+# доли оценки, на которых показываются кадры видео: (доля p50, доля p90) — берётся большее
+VIDEO_CURVE = [(0, 0), (0.2, 0), (0.45, 0), (0.8, 0), (1.0, 0.9), (0, 1.0)]
+# не чаще одной правки бара за столько секунд, даже если оценка очень короткая
+MIN_EDIT_GAP = 5.0
+
+
+def video_schedule(p50: float, p90: float) -> List[float]:
+    """Смещения кадров видео от старта по оценке длительности (p50, p90)."""
+    offsets: List[float] = []
+    for share50, share90 in VIDEO_CURVE:
+        at = max(share50 * p50, share90 * p90)
+        offsets.append(max(at, offsets[-1] + MIN_EDIT_GAP) if offsets else at)
+    return offsets
+
+
+class _Bar:
+    __slots__ = ("key", "bot", "chat_id", "message_id", "frames", "delay", "index", "text", "due", "persist",
+                 "offsets", "started")
+
+    def __init__(
+        self,
+        key: str,
+        bot: Bot,
+        chat_id: int,
+        message_id: int,
+        frames: List[str],
+        delay: float,
+        persist: bool = False,
+        offsets: Optional[List[float]] = None,
+    ):
+        self.key = key
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.frames = frames
+        self.delay = delay
+        self.index = 0
+        self.text: Optional[str] = None
+        self.due = 0.0
+        self.persist = persist
+        # кадры по кривой оценки длительности; без неё — каждые delay секунд
+        self.offsets = offsets
+        self.started = time.monotonic()
+
+    @property
+    def animating(self) -> bool:
+        return self.index < len(self.frames)
+
+    def next_due(self, now: float) -> float:
+        if self.offsets is None:
+            return now + self.delay
+        return max(self.started + self.offsets[self.index], now + MIN_EDIT_GAP)
+
+    def hold_period(self) -> float:
+        """Как часто перепроверять статус, пока бар держится на предпоследнем кадре."""
+        if self.offsets is None:
+            return self.delay
+        # для долгих генераций — реже
+        return max(15.0, self.offsets[-1] / 10)
+
+
+class ProgressEngine:
+    """
+    Все прогресс-бары процесса в одном цикле.
+
+    Бары лежат в куче по времени следующего кадра; цикл спит до ближайшего,
+    забирает все наступившие (не больше `batch`) и правит их одним gather'ом.
+    Кадр с тем же текстом, что уже в сообщении, не отправляется.
+    После последнего кадра бар ещё `linger` секунд ждёт finish (чтобы удалить сообщение),
+    затем забывается.
+
+    Бары с persist=True (генерация видео) ещё и записываются в Redis (task_id -> chat_id,
+    message_id, stage, started_at): finish на любом воркере или после рестарта находит
+    сообщение по записи и удаляет его, а цикл владельца перестаёт править бар, запись
+    которого исчезла. Сообщения, до которых finish так и не дошёл, раз в `sweep_interval`
+    удаляет sweep — один воркер за раз, под блокировкой в Redis.
+    """
+    SWEEP_LOCK = "progress:sweeper:lock"
+
+    def __init__(
+        self,
+        batch: int = 50,
+        max_age: int = 7200,
+        sweep_interval: int = 300,
+        redis: Optional[RedisClient] = None,
+    ):
+        self.batch = batch
+        self.linger = max_age
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self._redis = redis
+        self._sweeper: Optional[asyncio.Task] = None
+        self._bars: Dict[str, _Bar] = {}
+        self._heap: List[Tuple[float, int, _Bar]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        metrics.gauge("progress.active", lambda: sum(1 for bar in self._bars.values() if bar.animating))
+        metrics.gauge("progress.bars", lambda: len(self._bars))
+
+    @property
+    def redis(self) -> RedisClient:
+        if self._redis is None:
+            self._redis = RedisClient()
+        return self._redis
+
+    async def start(
+        self,
+        key: str,
+        bot: Bot,
+        chat_id: int,
+        message_id: int,
+        stage: str,
+        persist: bool = False,
+        estimate: Optional[Tuple[float, float]] = None,
+    ) -> None:
+        """
+        Запускает бар на сообщении; бар с тем же ключом заменяется.
+        estimate — (p50, p90) длительности генерации: кадры видео идут по этой кривой.
+        """
+        delay, frames = STAGES[stage]
+        offsets = video_schedule(*estimate) if estimate and stage == "video" else None
+        bar = _Bar(key, bot, chat_id, message_id, frames, delay, persist, offsets)
+        if persist:
+            record = {"chat_id": chat_id, "message_id": message_id, "stage": stage, "started_at": int(time.time())}
+            try:
+                await self.redis.set_progress(key, record, ttl=self.max_age + self.sweep_interval * 2)
+            except Exception as e:
+                logging.warning("progress registry unavailable for %s: %s", key, e)
+        self._bars[key] = bar
+        self._schedule(bar, time.monotonic())
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="progress-engine")
+
+    def cancel(self, key: str) -> bool:
+        """Останавливает бар, сообщение остаётся как есть."""
+        return self._bars.pop(key, None) is not None
+
+    async def finish(self, key: str, bot: Optional[Bot] = None) -> bool:
+        """
+        Останавливает бар и удаляет его сообщение. Бар, запущенный другим воркером
+        или до рестарта, находится по записи в Redis. False — такого бара нет.
+        """
+        bar = self._bars.pop(key, None)
+        try:
+            record = await self.redis.pop_progress(key)
+        except Exception as e:
+            logging.warning("progress registry unavailable for %s: %s", key, e)
+            record = None
+        if bar is not None:
+            chat_id, message_id, bot = bar.chat_id, bar.message_id, bot or bar.bot
+        elif record is not None and bot is not None:
+            chat_id, message_id = record["chat_id"], record["message_id"]
+            metrics.inc("progress.finished.remote")
+        else:
+            return False
+        with suppress(Exception):
+            await bot.delete_message(chat_id, message_id)
+        return True
+
+    def start_sweeper(self, bot: Bot) -> None:
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop(bot), name="progress-sweeper")
+
+    async def sweep(self, bot: Bot, limit: int = 500) -> int:
+        """Удаляет сообщения баров старше max_age, пачками по чатам. Возвращает число сообщений."""
+        keys = await self.redis.stale_progress(time.time() - self.max_age, limit=limit)
+        by_chat: Dict[int, List[int]] = {}
+        for key in keys:
+            self._bars.pop(key, None)
+            record = await self.redis.pop_progress(key)
+            if record is not None:
+                by_chat.setdefault(record["chat_id"], []).append(record["message_id"])
+        swept = 0
+        for chat_id, message_ids in by_chat.items():
+            for i in range(0, len(message_ids), 100):  # deleteMessages принимает до 100 id
+                chunk = message_ids[i:i + 100]
+                with suppress(Exception):
+                    await bot.delete_messages(chat_id, chunk)
+                swept += len(chunk)
+        if swept:
+            metrics.inc("progress.swept", swept)
+        return swept
+
+    async def _sweep_loop(self, bot: Bot) -> None:
+        while True:
+            try:
+                # на интервал sweep'ает только воркер, взявший блокировку
+                if await self.redis.set_once(self.SWEEP_LOCK, ttl=self.sweep_interval):
+                    await self.sweep(bot)
+            except Exception as e:
+                logging.warning("progress sweep failed: %s", e)
+            await asyncio.sleep(self.sweep_interval)
+
+    async def close(self) -> None:
+        self._bars.clear()
+        self._heap.clear()
+        for task in (self._task, self._sweeper):
+            if task is not None:
+                task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await task
+        self._task = self._sweeper = None
+
+    def _schedule(self, bar: _Bar, due: float) -> None:
+        bar.due = due
+        heapq.heappush(self._heap, (due, next(self._seq), bar))
+        self._wakeup.set()
+
+    def _pop_due(self, now: float) -> List[_Bar]:
+        due: List[_Bar] = []
+        while self._heap and self._heap[0][0] <= now and len(due) < self.batch:
+            at, _, bar = heapq.heappop(self._heap)
+            # отменённый/заменённый бар или устаревшая запись
+            if self._bars.get(bar.key) is not bar or bar.due != at:
+                continue
+            if not bar.animating:
+                del self._bars[bar.key]
+                continue
+            due.append(bar)
+        return due
+
+    async def _sync_registry(self, bars: List[_Bar]) -> Tuple[List[_Bar], List[_Bar]]:
+        """
+        Сверка с Redis для баров генерации: чья запись исчезла — финализированы другим
+        воркером и выбывают; последний кадр ("100%") показывается, только когда поллер
+        статусов KIE увидел готовое видео, — до этого бар держится на предпоследнем.
+        Возвращает (править, держать).
+        """
+        persisted = [bar for bar in bars if bar.persist]
+        if not persisted:
+            return bars, []
+        try:
+            alive = await self.redis.progress_exists([bar.key for bar in persisted])
+        except Exception:
+            return bars, []
+        gone = {bar.key for bar, exists in zip(persisted, alive) if not exists}
+        for key in gone:
+            self._bars.pop(key, None)
+        bars = [bar for bar in bars if bar.key not in gone]
+
+        closing = [bar for bar in bars if bar.persist and bar.index == len(bar.frames) - 1]
+        held: set[str] = set()
+        if closing:
+            try:
+                statuses = await self.redis.get_statuses([bar.key for bar in closing])
+            except Exception:
+                statuses = [None] * len(closing)
+            held = {bar.key for bar, status in zip(closing, statuses) if (status or {}).get("status") != "success"}
+        return [bar for bar in bars if bar.key not in held], [bar for bar in bars if bar.key in held]
+
+    async def _edit(self, bar: _Bar) -> None:
+        text = bar.frames[bar.index]
+        bar.index += 1
+        if text == bar.text:
+            metrics.inc("progress.edits.skipped")
+            return
+        try:
+            await bar.bot.edit_message_text(text, chat_id=bar.chat_id, message_id=bar.message_id)
+            bar.text = text
+            metrics.inc("progress.edits")
+        except Exception as e:
+            metrics.inc("progress.edits.failed")
+            logging.debug("progress edit %s failed: %s", bar.key, e)
+
+    async def _run(self) -> None:
+        while self._bars:
+            now = time.monotonic()
+            bars = self._pop_due(now)
+            if bars:
+                bars, held = await self._sync_registry(bars)
+                with outbound_priority(Priority.PROGRESS):
+                    await asyncio.gather(*(self._edit(bar) for bar in bars))
+                now = time.monotonic()
+                for bar in bars:
+                    if self._bars.get(bar.key) is bar:
+                        self._schedule(bar, bar.next_due(now) if bar.animating else now + self.linger)
+                for bar in held:
+                    if self._bars.get(bar.key) is bar:
+                        self._schedule(bar, now + bar.hold_period())
+                continue
+            if not self._heap:
+                break
+            self._wakeup.clear()
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._heap[0][0] - now)
+
+
+_env = ENV()
+progress = ProgressEngine(max_age=_env.progress_max_age, sweep_interval=_env.progress_sweep_interval)
+
+
+async def start_progress(
+    msg: types.Message,
+    stage: str,
+    key: Optional[str] = None,
+    estimate: Optional[Tuple[float, float]] = None,
+) -> str:
+    """
+    Бар на сообщении msg; возвращает ключ для cancel/finish.
+    С явным key (task_id генерации) бар попадает в реестр Redis и finish_progress
+    сработает на любом воркере.
+    """
+    persist = key is not None
+    key = key or f"{msg.chat.id}:{msg.message_id}"
+    await progress.start(key, msg.bot, msg.chat.id, msg.message_id, stage, persist=persist, estimate=estimate)
+    return key
 
 
 async def finish_progress(task_id: str, bot: Bot):
-    info = PROGRESS.pop(task_id, None)
-    if not info:
-        return
-    task = info["task"]
-    task.cancel()
-    with suppress(asyncio.CancelledError):
-        await task
-    # пробуем удалить сообщение
-    with suppress(Exception):
-        await bot.delete_message(info["chat_id"], info["message_id"])
+    await progress.finish(task_id, bot)